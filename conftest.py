@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the functionality package is imported from the repository root, also when
+# running plain pytest
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
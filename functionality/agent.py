@@ -1,9 +1,7 @@
 from mesa import Agent
-import random
 import numpy as np
 
-from .path_finder import find_path
-from .cell import Cell
+from .path_finder import detour_feasible, destination_offsets
 
 
 class Human(Agent):
@@ -18,20 +16,47 @@ class Human(Agent):
         super().__init__(unique_id, model)
         self.pos = pos
         self.home = pos
-        self.max_travel_time = np.random.randint(5, 10)
+        self.max_travel_time = model.streams.setup.integers(5, 10)
         self.speed = speed
         self.character = character
         self.interaction = False
-        self.path = []
-        self.destinations = self.find_possible_destionations()
+        self._waypoints = np.empty((0, 2), dtype=np.int32)
+        self._cursor = 0
+        self.offsets = destination_offsets(speed, self.max_travel_time)
+        self.reachable = self.find_possible_destionations()
+
+    @property
+    def destinations(self):
+        '''
+        Returns coordinates of all reachable trip destinations.
+        '''
+        return np.asarray(self.home) + self.offsets[self.reachable]
+
+    @property
+    def path(self):
+        '''
+        Returns read-only array of the remaining waypoints (grid positions)
+        of the current path.
+        '''
+        remaining = self._waypoints[self._cursor:]
+        remaining.flags.writeable = False
+        return remaining
+
+    def set_path(self, steps):
+        '''
+        Stores path given as relative steps as absolute waypoints.
+        '''
+        steps = np.asarray(steps, dtype=np.int32).reshape(-1, 2)
+        self._waypoints = np.asarray(self.pos, dtype=np.int32) + np.cumsum(steps, axis=0, dtype=np.int32)
+        self._cursor = 0
 
     def step(self):
         '''
         Execute step (move/interact/create new trip/go home).
         '''
 
-        # create new trip if home
-        if self.is_home():
+        # create new trip if home and no trip was planned yet
+        if self.is_home() and not len(self.path):
             self.create_trip()
 
         # move if interacting and trip not completed
@@ -54,13 +79,8 @@ class Human(Agent):
         '''
         Returns list of friends.
         '''
-        others = self.model.friends_score[self.unique_id]
-        ids = others[others > 0].index
-        friends = []
-        for agent in self.model.schedule.agents:
-            if agent.unique_id in ids:
-                friends.append(agent)
-        return friends
+        friends, _, _, _ = self.model.friends_of(self.unique_id)
+        return [self.model.agents_by_id[self.model.state.ids[i]] for i in friends]
 
     def get_distance(self, point):
         '''
@@ -74,77 +94,59 @@ class Human(Agent):
         Returns average friends score, spatial distance, social distance.
         '''
 
-        friends = self.get_friends()
-
-        count = len(friends)
-        score_sum = 0
-        social_sum = 0
-        spatial_sum = 0
+        _, scores, social, spatial = self.model.friends_of(self.unique_id)
 
+        count = len(scores)
         if not count:
-            avg_score = score_sum
-            avg_social = social_sum
-            avg_spatial = spatial_sum
-        else:
-            for friend in friends:
-                score_sum += self.model.friends_score.at[self.unique_id, friend.unique_id]
-                social_sum += abs(self.character - friend.character)
-                spatial_sum += self.get_distance(friend.pos)
-            # Average
-            avg_score = score_sum/count
-            avg_social = social_sum/count
-            avg_spatial = spatial_sum/count
-
-        return avg_score, avg_social, avg_spatial, count
+            return 0, 0, 0, count
+        return scores.mean(), social.mean(), spatial.mean(), count
 
     def interact_with_neighbors(self):
         '''
         Interact with other Human agents on same cell.
         '''
 
-        # get agents on current position
-        neighbors = self.model.grid.get_cell_list_contents([self.pos])
-        for neighbor in neighbors:
+        # matrix indices of the agents on current position, agents alone on
+        # their cell have no one to interact with
+        occupants = self.model.occupancy.get(self.model.cell_id(self.pos), ())
+        if len(occupants) < 2:
+            return
 
-            # if other human agent on current position
-            if self.unique_id != neighbor.unique_id and type(neighbor) is Human:
+        state = self.model.state
+        i = state.index[self.unique_id]
+        for j in occupants:
 
-                # matrix indexing
-                i = np.max([self.unique_id, neighbor.unique_id])
-                j = np.min([self.unique_id, neighbor.unique_id])
+            # if other human agent on current position
+            if i != j:
+                self.model.pairs_checked += 1
+                neighbor_character = state.characters[j]
 
                 # social distance & suitability
-                character_dist = abs(self.character - neighbor.character)
+                character_dist = abs(self.character - neighbor_character)
                 suitability = 1 - np.abs(character_dist)
                 social_introversion = 1 - self.model.social_extroversion
 
                 # interact
-                if random.uniform(social_introversion, 1) < suitability:
-                    # reset 'last interaction' count (decay)
-                    self.model.last_interaction.values[i-1,j-1] = 0
-                    self.model.last_interaction.values[j-1, i-1] = 0
-
-                    # update friends score
-                    rand_suit = random.random() * suitability
-                    self.model.friends_score.values[i-1, j-1] += rand_suit
-                    self.model.friends_score.values[j-1, i-1] += rand_suit
+                rng = self.model.streams.interaction
+                if rng.uniform(social_introversion, 1) < suitability:
+                    # reset 'last interaction' count (decay) and update
+                    # friends score
+                    rand_suit = rng.random() * suitability
+                    state.interact(i, j, rand_suit)
 
                     # update cell values if running with social hubs
                     if self.model.hubs:
                         cell = self.get_cell()
-                        cell.update(self.character, neighbor.character)
+                        cell.update(self.character, neighbor_character)
 
-                self.model.interactions[i][j] += 1
+                state.count_interaction(i, j)
                 break
 
     def get_cell(self):
         '''
         Returns cell for current position
         '''
-        this_cell = self.model.grid.get_cell_list_contents([self.pos])
-        for agent in this_cell:
-            if type(agent) is Cell:
-                return agent
+        return self.model.get_cell(self.pos)
 
     def create_trip(self):
         '''
@@ -153,34 +155,43 @@ class Human(Agent):
         bounds = self.get_relative_bounds()
 
         path = False
-        while not path:
-            # get all possible destination cells
-            cells = []
-            for pos in self.destinations:
-                this_cell = self.model.grid.get_cell_list_contents([pos])
-                for agent in this_cell:
-                    if type(agent) is Cell:
-                        cells.append(agent)
-
-            # weighted random choice based on cell value if running with social hubs
-            if self.model.hubs:
-                value_sum = sum((1 - abs(self.character - cell.value)) for cell in cells)
-                w = [(1 - abs(self.character - cell.value)) / value_sum for cell in cells]
-                selected_cell = random.choices(population=cells, weights=w, k=1)
-                chosen_trip = selected_cell[0].pos
-            else:
-                selected_cell = random.choice(cells)
-                chosen_trip = selected_cell.pos
-
-            # find path to chosen destination
-            destination = [
-                chosen_trip[0] - self.pos[0],
-                chosen_trip[1] - self.pos[1]
-            ]
+        while path is False:
+            # find path to chosen destination, agents without reachable
+            # destinations stay home
+            index = self.choose_destination()
+            if index is None:
+                return
+            destination = self.offsets[index].tolist()
             trip_length = np.abs(destination[0]) + np.abs(destination[1])
-            path = find_path([0, 0], destination, trip_length + 2, bounds)
+            path = self.model.path_cache.find_path([0, 0], destination, trip_length + 2, bounds)
 
-        self.path = path
+            # only reachable destinations are chosen, this guards the loop
+            if path is False:
+                self.reachable[index] = False
+
+        self.set_path(path)
+
+    def choose_destination(self):
+        '''
+        Returns index of random reachable trip destination in the
+        destination offsets (relative to home), None if no destination is
+        reachable.
+        '''
+        targets = np.flatnonzero(self.reachable)
+        if not len(targets):
+            return None
+        rng = self.model.streams.trips
+
+        # weighted random choice based on cell value if running with social hubs
+        if self.model.hubs:
+            x, y = (np.asarray(self.home) + self.offsets[targets]).T
+            values = self.model.hub_values[x, y]
+            cumulative = np.cumsum(1 - np.abs(self.character - values))
+            if cumulative[-1] <= 0:
+                return None
+            index = np.searchsorted(cumulative, rng.random() * cumulative[-1], side='right')
+            return targets[min(index, len(targets) - 1)]
+        return targets[rng.integers(len(targets))]
 
     def go_home(self):
         '''
@@ -190,8 +201,9 @@ class Human(Agent):
         bounds = self.get_relative_bounds()
         destination = self.relative_home_location()
         trip_length = np.abs(destination[0]) + np.abs(destination[1])
-        path = find_path([0, 0], destination, trip_length + 2, bounds)
-        self.path = path
+        path = self.model.path_cache.find_path([0, 0], destination, trip_length + 2, bounds)
+        if path is not False:
+            self.set_path(path)
 
     def has_friends(self):
         '''
@@ -206,9 +218,8 @@ class Human(Agent):
         Returns number of friends.
         '''
 
-        friends_df = self.model.friends
-        uid = self.unique_id
-        friend_count = np.sum(friends_df[uid].values) + np.sum(friends_df.loc[uid].values)
+        state = self.model.state
+        friend_count = state.nr_friends(state.index[self.unique_id])
         return friend_count
 
     def is_home(self):
@@ -229,18 +240,13 @@ class Human(Agent):
         '''
         Perform next move/stap in path.
         '''
-        i = 0
-        while i < self.speed:
-            if len(self.path):
-                move = self.path.pop(0)
-                new_pos = (
-                    self.pos[0] + move[0],
-                    self.pos[1] + move[1]
-                )
-                self.model.grid.move_agent(self, new_pos)
-                i += 1
-            else:
-                break
+        # advance along the path by speed steps, only the final cell is
+        # placed on the grid
+        remaining = len(self._waypoints) - self._cursor
+        if remaining:
+            self._cursor += min(self.speed, remaining)
+            x, y = self._waypoints[self._cursor - 1]
+            self.model.move_human(self, (int(x), int(y)))
 
     def get_relative_bounds(self):
         '''
@@ -257,59 +263,14 @@ class Human(Agent):
         ]
         return bounds
 
-    def is_inside(self, p, max_x, max_y):
-        '''
-        Checks if coordinate p is within grid.
-        '''
-
-        x_in = 0 <= p[0] <= max_x
-        y_in = 0 <= p[1] <= max_y
-        return x_in and y_in
-
-    def find_manhattan_neighbors(self, radius):
-        '''
-        Returns coordinates of neighboring cells.
-        '''
-
-        neighbors = []
-        pos = self.pos
-        [max_x, max_y] = [self.model.grid.width - 1, self.model.grid.height - 1]
-        for i in range(radius+1):
-            if i != 0:
-                p = [i + pos[0], radius - i + pos[1]]
-                if self.is_inside(p, max_x, max_y):
-                    neighbors.append(p)
-                p = [-i + pos[0], radius - i + pos[1]]
-                if self.is_inside(p, max_x, max_y):
-                    neighbors.append(p)
-                if (radius - i) != 0:
-                    p = [i + pos[0], -(radius - i) + pos[1]]
-                    if self.is_inside(p, max_x, max_y):
-                        neighbors.append(p)
-                    p = [-i + pos[0], -(radius - i) + pos[1]]
-                    if self.is_inside(p, max_x, max_y):
-                        neighbors.append(p)
-            else:
-                p = [i + pos[0], radius - i + pos[1]]
-                if self.is_inside(p, max_x, max_y):
-                    neighbors.append(p)
-                p = [i + pos[0], -(radius - i) + pos[1]]
-                if self.is_inside(p, max_x, max_y):
-                    neighbors.append(p)
-        return neighbors
-
     def find_possible_destionations(self):
         '''
-        Returns coordinates of all possible destinations within range (based on
-        speed and maximum travel time).
+        Returns mask over the shared destination offsets (based on speed and
+        maximum travel time) of the destinations that are inside the grid and
+        reachable from home with a trip of length + 2.
         '''
 
-        min_trip_length = self.speed
-        max_trip_length = self.speed * self.max_travel_time
-        destinations = []
-        for i in range(min_trip_length, max_trip_length):
-            destinations.extend(self.find_manhattan_neighbors(i))
-        return destinations
+        return detour_feasible(self.offsets, self.get_relative_bounds())
 
     def random_move(self):
         '''
@@ -317,4 +278,5 @@ class Human(Agent):
         '''
         grid = self.model.grid
         neighborhood = grid.get_neighborhood(self.pos, True, radius=1)
-        grid.move_agent(self, random.choice(neighborhood))
+        rng = self.model.streams.movement
+        self.model.move_human(self, neighborhood[rng.integers(len(neighborhood))])
@@ -0,0 +1,314 @@
+import numpy as np
+import networkx as nx
+
+from .model import Friends
+from .path_finder import destination_offsets, detour_feasible, find_paths
+from . import kernels
+
+
+class ArrayFriends(Friends):
+    '''
+    Friends model that keeps the population as arrays (positions, homes,
+    speeds, characters and path buffers) instead of Human agents and
+    advances all agents per tick with NumPy. Interactions of all agents
+    are applied in one batch that follows the random activation of the
+    agent based model, runs are statistically equivalent to it but not
+    step for step the same. The reporters and the relationship state are
+    shared with Friends.
+    '''
+
+    def init_population(self, tolerance):
+        '''
+        Runs Schelling model based on grid size, tolerance level and population
+        size. Innitializes population arrays and home locations.
+        '''
+        positions, characters = self.init_layout(tolerance)
+        n = len(positions)
+        self.ids = np.arange(1, n + 1)
+        self.character = np.array(characters, dtype=float)
+        self.home = np.array(positions, dtype=np.int64).reshape(-1, 2)
+        self.pos = self.home.copy()
+        self.speed = 1 + (self.streams.setup.random(n) < self.mobility)
+        self.max_travel_time = self.streams.setup.integers(5, 10, size=n)
+
+        # path buffers of absolute waypoints, trips are at most the longest
+        # destination distance plus a detour of 2
+        max_length = int((self.speed * self.max_travel_time).max(initial=0)) + 1
+        self.waypoints = np.zeros((n, max_length, 2), dtype=np.int64)
+        self.path_length = np.zeros(n, dtype=np.int64)
+        self.cursor = np.zeros(n, dtype=np.int64)
+        self.init_destinations()
+
+    def init_destinations(self):
+        '''
+        Groups agents by speed and maximum travel time, all agents in a group
+        share the destination offsets and keep a mask of the reachable ones.
+        '''
+        bounds = np.array([self.width - 1, self.height - 1])
+        self.groups = []
+        keys = np.stack([self.speed, self.max_travel_time], axis=1)
+        for speed, max_travel_time in np.unique(keys, axis=0):
+            members = np.flatnonzero((keys == (speed, max_travel_time)).all(axis=1))
+            offsets = destination_offsets(speed, max_travel_time)
+            reachable = np.array([
+                detour_feasible(offsets, [-self.home[i], bounds - self.home[i]])
+                for i in members
+            ]).reshape(len(members), len(offsets))
+            self.groups.append((members, offsets, reachable))
+
+    def checkpoint_agents(self):
+        '''
+        Returns dict of the population arrays, path buffers and reachable
+        destinations (of all groups).
+        '''
+        return dict(
+            pos=self.pos,
+            speed=self.speed,
+            max_travel_time=self.max_travel_time,
+            waypoints=self.waypoints,
+            path_length=self.path_length,
+            cursor=self.cursor,
+            reachable=np.concatenate([np.empty(0, dtype=bool)] + [
+                reachable.ravel() for _, _, reachable in self.groups
+            ])
+        )
+
+    def restore_agents(self, arrays):
+        '''
+        Restores population arrays made by checkpoint_agents.
+        '''
+        for name in ('pos', 'speed', 'max_travel_time', 'waypoints', 'path_length', 'cursor'):
+            setattr(self, name, arrays[name].copy())
+        self.init_destinations()
+        start = 0
+        for _, _, reachable in self.groups:
+            reachable[...] = arrays['reachable'][start:start + reachable.size].reshape(reachable.shape)
+            start += reachable.size
+
+    def population(self):
+        '''
+        Returns ids, characters and homes of all agents.
+        '''
+        return self.ids, self.character, self.home
+
+    def positions(self):
+        '''
+        Returns current positions of all agents in state order.
+        '''
+        return self.pos
+
+    @property
+    def M(self):
+        '''
+        Node graph of the population, built in one pass when first used.
+        '''
+        if self._graph is None:
+            self._graph = nx.Graph()
+            self._graph.add_nodes_from(
+                (i, {'pos': tuple(home), 'speed': speed, 'character': character})
+                for i, (home, speed, character) in enumerate(zip(
+                    self.home.tolist(), self.speed.tolist(), self.character.tolist()
+                ))
+            )
+        return self._graph
+
+    def friends_of(self, unique_id):
+        '''
+        Returns matrix indices, friends scores, social distances and spatial
+        distances (from current positions) of the friends of an agent.
+        '''
+        i = self.state.index[unique_id]
+        friends, scores = self.state.scores_of(i)
+        social = np.abs(self.character[i] - self.character[friends])
+        spatial = np.abs(self.pos[friends] - self.pos[i]).sum(axis=1)
+        return friends, scores, social, spatial
+
+    def step(self):
+        '''
+        Execute next time step.
+        '''
+        self.plan_trips()
+        before = self.pos.copy()
+        self.move()
+        self.interact(before)
+
+        # friends_score decay functionality
+        self.state.decay(self.decay)
+
+        # Save the statistics
+        self.data_collector.collect(self)
+        self.check_convergence()
+
+    def plan_trips(self):
+        '''
+        Plans new trips for agents at home and paths home for agents at the
+        end of their trip, with one batched path search.
+        '''
+        idle = self.cursor >= self.path_length
+        at_home = (self.pos == self.home).all(axis=1)
+        leaving, index = self.choose_destinations(idle & at_home)
+        returning = np.flatnonzero(idle & ~at_home)
+
+        agents = np.concatenate([leaving, returning])
+        if not len(agents):
+            return
+        ends = np.concatenate([
+            self.home[leaving] + self.destination_offsets(leaving, index),
+            self.home[returning]
+        ])
+        starts = self.pos[agents]
+        lengths = np.abs(ends - starts).sum(axis=1) + 2
+        bounds = np.broadcast_to([[0, 0], [self.width - 1, self.height - 1]], (len(agents), 2, 2))
+        paths, lengths = find_paths(
+            starts, ends, lengths, bounds,
+            max_rounds=30, jit=self.jit, rng=self.streams.movement
+        )
+
+        # destinations without a path are not chosen again, agents without a
+        # path try again next step
+        failed = lengths[:len(leaving)] < 0
+        self.forget_destinations(leaving[failed], index[failed])
+
+        found = lengths >= 0
+        agents, paths, lengths = agents[found], paths[found], lengths[found]
+        steps = np.cumsum(paths, axis=1, dtype=np.int64)
+        self.waypoints[agents, :steps.shape[1]] = self.pos[agents, None] + steps
+        self.path_length[agents] = lengths
+        self.cursor[agents] = 0
+
+    def choose_destinations(self, mask):
+        '''
+        Returns agents in mask with at least one reachable destination and
+        the index of a random reachable destination per agent (weighted by
+        cell value if running with social hubs).
+        '''
+        agents = []
+        indices = []
+        for members, offsets, reachable in self.groups:
+            rows = np.flatnonzero(mask[members])
+            if not len(rows) or not len(offsets):
+                continue
+            weights = reachable[rows].astype(float)
+            if self.hubs:
+                # cells outside the grid are unreachable, they are clipped
+                # only to look up a value
+                cells = self.home[members[rows], None] + offsets
+                cells = np.clip(cells, 0, [self.width - 1, self.height - 1])
+                values = self.hub_values[cells[..., 0], cells[..., 1]]
+                weights *= 1 - np.abs(self.character[members[rows], None] - values)
+
+            # inverse transform sampling per row
+            cumulative = np.cumsum(weights, axis=1)
+            total = cumulative[:, -1]
+            draw = self.streams.trips.random(len(rows)) * total
+            index = (cumulative <= draw[:, None]).sum(axis=1)
+            chosen = total > 0
+            agents.append(members[rows[chosen]])
+            indices.append(np.minimum(index[chosen], len(offsets) - 1))
+        if not agents:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(agents), np.concatenate(indices)
+
+    def destination_offsets(self, agents, index):
+        '''
+        Returns destination offsets (relative to home) with the given index
+        for the given agents.
+        '''
+        offsets = np.empty((len(agents), 2), dtype=np.int64)
+        for members, group_offsets, _ in self.groups:
+            selected = np.isin(agents, members)
+            offsets[selected] = group_offsets[index[selected]]
+        return offsets
+
+    def forget_destinations(self, agents, index):
+        # marks destinations as unreachable for the given agents
+        for members, _, reachable in self.groups:
+            selected = np.isin(agents, members)
+            rows = np.searchsorted(members, agents[selected])
+            reachable[rows, index[selected]] = False
+
+    def interact(self, before):
+        '''
+        Every agent interacts with a random other agent on the cell it was on
+        before moving. Like random activation, agents earlier in a random
+        order are seen on the cell they moved to and later agents on the cell
+        they were on.
+        '''
+        n = len(self.ids)
+        if n < 2:
+            return
+        rng = self.streams.interaction
+        rank = rng.permutation(n)
+        draws = rng.random(n)
+        cells_after = self.pos[:, 0] * self.height + self.pos[:, 1]
+        cells_before = before[:, 0] * self.height + before[:, 1]
+        if self.jit:
+            i, j = kernels.resolve_partners(cells_before, cells_after, rank, draws)
+        else:
+            i, j = self.resolve_partners(cells_before, cells_after, rank, draws)
+        self.pairs_checked += len(i)
+        if not len(i):
+            return
+
+        # social distance & suitability
+        suitability = 1 - np.abs(self.character[i] - self.character[j])
+        social_introversion = 1 - self.social_extroversion
+        draw = rng.uniform(social_introversion, 1, size=len(i))
+        success = draw < suitability
+
+        # update friends scores and cell values if running with social hubs
+        amounts = rng.random(len(i)) * suitability
+        self.state.interact_many(i[success], j[success], amounts[success])
+        if self.hubs:
+            self.update_hubs(
+                before[i[success]],
+                self.character[i[success]],
+                self.character[j[success]]
+            )
+        self.state.count_many(i, j)
+
+    def resolve_partners(self, cells_before, cells_after, rank, draws):
+        '''
+        Returns agents (in activation order) that share their cell with
+        other agents and a random partner for each, draws holds one uniform
+        number per agent in activation order.
+        '''
+        n = len(rank)
+        by_rank = np.argsort(rank)
+        i = by_rank
+
+        # sorted (cell, rank) keys of agents after and before moving
+        after = np.sort(cells_after * n + rank)
+        before = np.sort(cells_before * n + rank)
+
+        # earlier agents on the cell after moving and later agents on the
+        # cell before moving, every agent in activation order
+        cell = cells_before[i] * n
+        first_after = np.searchsorted(after, cell)
+        earlier = np.searchsorted(after, cell + rank[i]) - first_after
+        first_before = np.searchsorted(before, cell + rank[i] + 1)
+        later = np.searchsorted(before, cell + n) - first_before
+
+        # pick a random other agent
+        count = earlier + later
+        shared = count > 0
+        pick = np.floor(draws[shared] * count[shared]).astype(np.int64)
+        earlier, first_after, first_before = earlier[shared], first_after[shared], first_before[shared]
+        keys = np.where(
+            pick < earlier,
+            after[np.minimum(first_after + pick, n - 1)],
+            before[np.minimum(np.maximum(first_before + pick - earlier, 0), n - 1)]
+        )
+        return i[shared], by_rank[keys % n]
+
+    def move(self):
+        '''
+        Advance all agents along their paths by speed steps.
+        '''
+        if self.jit:
+            kernels.move_paths(self.pos, self.waypoints, self.path_length, self.cursor, self.speed)
+            return
+        remaining = self.path_length - self.cursor
+        moving = np.flatnonzero(remaining > 0)
+        self.cursor[moving] += np.minimum(self.speed[moving], remaining[moving])
+        self.pos[moving] = self.waypoints[moving, self.cursor[moving] - 1]
@@ -1,23 +1,18 @@
-from mesa import Agent
-
-class Cell(Agent):
+class Cell:
     '''
-    Cell class for all cells on the grid that keeps track of the cells'
-    coordinates and the current cell value (used for social hubs).
+    View of a single grid cell that reads and writes the cell value (used for
+    social hubs) in the hub_values array of the model.
     '''
-    def __init__(self, unique_id, model, pos, value):
-        super().__init__(unique_id, model)
+    def __init__(self, model, pos):
+        self.model = model
         self.pos = pos
-        self.value = value
+
+    @property
+    def value(self):
+        return self.model.hub_values[self.pos]
 
     def update(self, score1, score2):
         '''
         Update cell value to equal average of the passed in character scores.
         '''
-        self.value = (score1 + score2)/2
-
-    def step(self):
-        '''
-        Skip step.
-        '''
-        pass
+        self.model.update_hubs([self.pos], score1, score2)
@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class ConvergenceMonitor:
+    '''
+    Detects a steady state of the collected model reporters. After every
+    step the means of the last two windows of window steps are compared per
+    reporter, the run has converged when they differ by at most
+    atol + rtol * |mean of the older window| for every reporter and at
+    least min_steps steps were run. Reporters are all model reporters of
+    the data collector by default.
+    '''
+
+    def __init__(self, window=50, rtol=0.01, atol=1e-6, min_steps=100, reporters=None):
+        self.window = window
+        self.rtol = rtol
+        self.atol = atol
+        self.min_steps = min_steps
+        self.reporters = reporters
+        self.converged_at = None
+
+    def update(self, model):
+        '''
+        Checks the reporter values collected so far, returns True once the
+        run has converged and records the step it converged at.
+        '''
+        if self.converged_at is not None:
+            return True
+
+        model_vars = model.data_collector.model_vars
+        reporters = self.reporters or list(model_vars)
+
+        # the first values are collected before the first step
+        steps = len(model_vars[reporters[0]]) - 1
+        if steps < max(self.min_steps, 2 * self.window):
+            return False
+
+        for name in reporters:
+            values = np.asarray(model_vars[name][-2 * self.window:], dtype=float)
+            older = values[:self.window].mean()
+            newer = values[self.window:].mean()
+            if abs(newer - older) > self.atol + self.rtol * abs(older):
+                return False
+
+        self.converged_at = steps
+        return True
@@ -1,10 +1,11 @@
 import numpy as np
-import pandas as pd
 import networkx as nx
 
+from .streams import default_rng
 
-def choose_speed(speed_dist):
-    choice = np.random.random()
+
+def choose_speed(speed_dist, rng=None):
+    choice = default_rng(rng).random()
     if choice < speed_dist[0]:
         speed = 1
     elif choice < speed_dist[0] + speed_dist[1]:
@@ -14,6 +15,17 @@ def choose_speed(speed_dist):
     return speed
 
 
+def sample_positions(width, height, n, rng=None):
+    '''
+    Returns n distinct random (x, y) cells of a width x height grid, drawn in
+    one sample without replacement from rng
+    '''
+    if n > width * height:
+        raise ValueError('cannot place %d agents on a %d x %d grid' % (n, width, height))
+    cells = default_rng(rng).choice(width * height, n, replace=False)
+    return np.stack([cells // height, cells % height], axis=1)
+
+
 def create_segregation_centers(seg_number, width, height):
     '''
     Create segregation centers for Schelling model
@@ -38,19 +50,10 @@ def create_sim_stats(schedule, M, iterating, file_name=None):
     '''
     Create aggregated simulation statistics
     '''
-    sim_stats = pd.DataFrame()
-
-    for agent in schedule.agents:
-        nx.set_node_attributes(M, {(agent.unique_id - 1): {'character': agent.character}})
-        score, social, spatial, count = agent.get_avg()
-        stats = dict(
-            agent_id=agent.unique_id,
-            friend_count=count,
-            avg_friend_score=score,
-            avg_social_dist=social,
-            avg_spatial_dist=spatial)
-
-        sim_stats = sim_stats.append(stats, ignore_index=True)
+    model = schedule.model
+    characters = {(agent.unique_id - 1): {'character': agent.character} for agent in schedule.agents}
+    nx.set_node_attributes(M, characters)
+    sim_stats = model.friend_stats()
 
     if iterating:
         return sim_stats
@@ -0,0 +1,207 @@
+'''
+Numba compiled kernels for the hot loops of the model: path generation,
+moving along paths, pairing agents on the same cell, the dense decay update
+and the friends averages. Numba is optional, without it AVAILABLE is False
+and the models keep using their NumPy code. Compiled kernels are cached on
+disk, warmup() compiles (or loads) all of them up front, e.g. once per
+worker process.
+'''
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+AVAILABLE = numba is not None
+
+# unit steps indexed by direction: +x, +y, -x, -y
+STEP_X = np.array([1, 0, -1, 0], dtype=np.int64)
+STEP_Y = np.array([0, 1, 0, -1], dtype=np.int64)
+
+
+def jit(func):
+    # compiles func in nopython mode with the compiled code cached on disk
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+@jit
+def shuffle_paths(counts, starts, lengths, bounds, has_bounds, max_length, seed, max_tries):
+    '''
+    Draws random orders of every row's steps (counts per direction) until
+    the path is self-avoiding and stays within bounds, at most max_tries
+    times. Returns int8 steps with shape (K, max_length, 2) and which rows
+    have a valid path.
+    '''
+    np.random.seed(seed)
+    k = counts.shape[0]
+    paths = np.zeros((k, max_length, 2), dtype=np.int8)
+    valid = np.zeros(k, dtype=np.bool_)
+
+    # visited cells relative to the start, marked with the try number
+    size = 2 * max_length + 1
+    visited = np.zeros(size * size, dtype=np.int64)
+    codes = np.empty(max_length, dtype=np.int64)
+    mark = 0
+
+    for row in range(k):
+        length = lengths[row]
+        m = 0
+        for direction in range(4):
+            for _ in range(counts[row, direction]):
+                codes[m] = direction
+                m += 1
+
+        for _ in range(max_tries):
+            for a in range(length - 1, 0, -1):
+                b = np.random.randint(0, a + 1)
+                codes[a], codes[b] = codes[b], codes[a]
+
+            mark += 1
+            x = 0
+            y = 0
+            visited[max_length * size + max_length] = mark
+            ok = True
+            for s in range(length):
+                x += STEP_X[codes[s]]
+                y += STEP_Y[codes[s]]
+                cell = (x + max_length) * size + y + max_length
+                if visited[cell] == mark:
+                    ok = False
+                    break
+                visited[cell] = mark
+                if has_bounds:
+                    px = starts[row, 0] + x
+                    py = starts[row, 1] + y
+                    if px < bounds[row, 0, 0] or px > bounds[row, 1, 0] \
+                            or py < bounds[row, 0, 1] or py > bounds[row, 1, 1]:
+                        ok = False
+                        break
+
+            if ok:
+                for s in range(length):
+                    paths[row, s, 0] = STEP_X[codes[s]]
+                    paths[row, s, 1] = STEP_Y[codes[s]]
+                valid[row] = True
+                break
+    return paths, valid
+
+
+@jit
+def move_paths(pos, waypoints, path_length, cursor, speed):
+    '''
+    Advances all agents along their waypoints by speed steps (in place).
+    '''
+    for a in range(pos.shape[0]):
+        remaining = path_length[a] - cursor[a]
+        if remaining > 0:
+            cursor[a] += min(speed[a], remaining)
+            pos[a, 0] = waypoints[a, cursor[a] - 1, 0]
+            pos[a, 1] = waypoints[a, cursor[a] - 1, 1]
+
+
+@jit
+def resolve_partners(cells_before, cells_after, rank, draws):
+    '''
+    Pairs every agent with a random other agent on the cell it was on before
+    moving, agents earlier in activation order (rank) are on the cell they
+    moved to and later agents on the cell they were on. Draws holds one
+    uniform number per agent in activation order. Returns the agents that
+    found a partner in activation order and their partners.
+    '''
+    n = rank.shape[0]
+    by_rank = np.argsort(rank)
+    after = np.sort(cells_after * n + rank)
+    before = np.sort(cells_before * n + rank)
+
+    agents = np.empty(n, dtype=np.int64)
+    partners = np.empty(n, dtype=np.int64)
+    m = 0
+    for r in range(n):
+        a = by_rank[r]
+        cell = cells_before[a] * n
+        first_after = np.searchsorted(after, cell)
+        earlier = np.searchsorted(after, cell + r) - first_after
+        first_before = np.searchsorted(before, cell + r + 1)
+        later = np.searchsorted(before, cell + n) - first_before
+        count = earlier + later
+        if count == 0:
+            continue
+
+        pick = int(np.floor(draws[r] * count))
+        if pick < earlier:
+            key = after[first_after + pick]
+        else:
+            key = before[first_before + pick - earlier]
+        agents[m] = a
+        partners[m] = by_rank[key % n]
+        m += 1
+    return agents[:m], partners[:m]
+
+
+@jit
+def decay_dense(scores, last_touched, tick, decay):
+    '''
+    Multiplies the symmetric friends scores of all pairs not touched at tick
+    by decay (in place). Returns the (i < j) pairs whose score reached zero.
+    '''
+    n = scores.shape[0]
+    lost = []
+    for i in range(n):
+        for j in range(i + 1, n):
+            score = scores[i, j]
+            if score != 0 and last_touched[i, j] != tick:
+                score *= decay
+                scores[i, j] = score
+                scores[j, i] = score
+                if score == 0:
+                    lost.append(i * n + j)
+
+    rows = np.empty(len(lost), dtype=np.int64)
+    cols = np.empty(len(lost), dtype=np.int64)
+    for k in range(len(lost)):
+        rows[k] = lost[k] // n
+        cols[k] = lost[k] % n
+    return rows, cols
+
+
+@jit
+def average_sums(sums, count):
+    '''
+    Returns average over all agents of sums divided by count (0 for agents
+    without friends).
+    '''
+    n = sums.shape[0]
+    if n == 0:
+        return 0.0
+    total = 0.0
+    for a in range(n):
+        if count[a] > 0:
+            total += sums[a] / count[a]
+    return total / n
+
+
+def warmup():
+    '''
+    Compiles all kernels (or loads them from the on-disk cache) on tiny
+    inputs, so later calls don't pay the compile cost.
+    '''
+    if not AVAILABLE:
+        return False
+    counts = np.array([[1, 1, 0, 0]], dtype=np.int64)
+    starts = np.zeros((1, 2), dtype=np.int64)
+    bounds = np.array([[[0, 0], [1, 1]]], dtype=np.int64)
+    shuffle_paths(counts, starts, np.array([2]), bounds, True, 2, 0, 1)
+
+    pos = np.zeros((1, 2), dtype=np.int64)
+    waypoints = np.zeros((1, 1, 2), dtype=np.int64)
+    ones = np.ones(1, dtype=np.int64)
+    move_paths(pos, waypoints, ones, np.zeros(1, dtype=np.int64), ones)
+
+    cells = np.zeros(2, dtype=np.int64)
+    resolve_partners(cells, cells, np.arange(2), np.zeros(2))
+    decay_dense(np.zeros((2, 2)), np.zeros((2, 2), dtype=np.int64), 0, 0.5)
+    average_sums(np.zeros(2), np.zeros(2, dtype=np.int64))
+    return True
@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+import tempfile
+import zipfile
+import numpy as np
+
+
+class LayoutCache:
+    '''
+    On-disk cache of finished Schelling layouts (home positions and
+    characters) stored as compressed .npz files, named by a hash of the
+    parameters that produced them. At most max_entries layouts are kept,
+    the least recently used ones are evicted.
+
+    Files are written to a temporary file and renamed into place, so
+    processes sharing the directory never read a partial layout, a layout
+    that disappears or can't be read counts as a miss.
+    '''
+
+    # bump when the warm-up changes, older layouts are no longer used
+    VERSION = 2
+
+    def __init__(self, directory=os.path.join('data', 'layouts'), max_entries=256):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, **params):
+        '''
+        Returns content hash of the layout parameters.
+        '''
+        params['version'] = self.VERSION
+        text = json.dumps(params, sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key):
+        '''
+        Returns dict with the arrays of a cached layout, None if not cached.
+        '''
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                layout = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return layout
+
+    def save(self, key, **arrays):
+        '''
+        Stores the arrays of a layout and evicts the least recently used
+        layouts over max_entries.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        # remove least recently used layouts, other processes may remove
+        # the same files at the same time
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        '''
+        Returns hit/miss counters and the number of cached layouts.
+        '''
+        size = 0
+        if os.path.isdir(self.directory):
+            size = sum(name.endswith('.npz') for name in os.listdir(self.directory))
+        return dict(hits=self.hits, misses=self.misses, size=size)
+
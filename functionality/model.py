@@ -1,3 +1,6 @@
+import os
+import json
+import tempfile
 import numpy as np
 import pandas as pd
 import networkx as nx
@@ -7,8 +10,14 @@ from mesa.space import MultiGrid
 from mesa.datacollection import DataCollector
 from mesa.time import RandomActivation
 
-from .agent import Human, Cell
-from .schelling import SchellingModel
+from .agent import Human
+from .cell import Cell
+from .schelling import ArraySchellingModel
+from .path_finder import PathCache, destination_offsets, find_paths
+from . import kernels
+from .state import DenseState, SparseState
+from .streams import RandomStreams
+from .convergence import ConvergenceMonitor
 
 
 class Friends(Model):
@@ -23,11 +32,53 @@ class Friends(Model):
             social_extroversion=0.6,
             decay=0.99,
             mobility = 0.5,
-            hubs = True
+            hubs = True,
+            path_cache_size=4096,
+            path_pool_size=8,
+            batch_paths=False,
+            sparse=False,
+            debug_stats=False,
+            lazy_decay=False,
+            jit=False,
+            seed=None,
+            layout_cache=None,
+            convergence=None,
+            layout=None
     ):
 
         super().__init__()
 
+        # constructor arguments, stored in checkpoints
+        self.parameters = dict(
+            height=height, width=width,
+            population_size=population_size,
+            tolerance=tolerance,
+            social_extroversion=social_extroversion,
+            decay=decay,
+            mobility=mobility,
+            hubs=hubs,
+            path_cache_size=path_cache_size,
+            path_pool_size=path_pool_size,
+            batch_paths=batch_paths,
+            sparse=sparse,
+            debug_stats=debug_stats,
+            lazy_decay=lazy_decay,
+            jit=jit,
+            seed=seed,
+            convergence=convergence
+        )
+
+        # independent random streams derived from seed, Mesa's random
+        # (activation order) is seeded from the schedule stream, with a seed
+        # the finished layout can be taken from the layout cache
+        self.seed = seed
+        self.streams = RandomStreams(seed)
+        self.reset_randomizer(self.streams.seed_of('schedule'))
+        self.layout_cache = layout_cache
+
+        # (positions, characters) of a finished layout skip the warm-up
+        self.layout = layout
+
         self.height = height
         self.width = width
         self.population_size = population_size
@@ -36,6 +87,13 @@ class Friends(Model):
         self.social_extroversion = social_extroversion
         self.decay = decay
 
+        # cache of relative path templates shared by all agents
+        self.path_cache = PathCache(path_cache_size, path_pool_size, self.streams.movement)
+        self.batch_paths = batch_paths
+
+        # compiled kernels are only used when numba is available
+        self.jit = jit and kernels.AVAILABLE
+
         # add a schedule and a grid
         self.schedule = RandomActivation(self)
         self.grid = MultiGrid(self.width, self.height, torus=False)
@@ -47,18 +105,34 @@ class Friends(Model):
             "Friends spatial distance": lambda m: self.avg_friends_spatial_distance()
         })
 
-        # create the population
-        self.M = nx.Graph()
+        # create the population, agents are also registered by id
+        self.agents_by_id = {}
+        self._graph = None
         self.init_population(tolerance)
-        self.init_cells()
+        self.init_hubs()
 
         # matrices to keep track of friends, friends scores, interaction count
-        # time since last interaction, social distance and spatial distance
-        self.friends = self.init_matrix() # not used
-        self.friends_score = self.init_matrix()
-        self.interactions = self.init_matrix()
-        self.last_interaction = self.init_matrix()
-        [self.social_distance, self.spatial_distance] = self.init_distances()
+        # time since last interaction, social distance and spatial distance,
+        # the sparse state only stores pairs that interacted
+        ids, characters, homes = self.population()
+        state = SparseState if sparse else DenseState
+        self.state = state(
+            ids, characters, homes,
+            lazy_decay=decay if lazy_decay else None
+        )
+        self.state.debug = debug_stats
+        self.state.jit = self.jit
+
+        # humans on every occupied cell and same-cell pairs checked
+        self.init_occupancy()
+        self.pairs_checked = 0
+        if not sparse:
+            self.init_distances()
+
+        # optional steady state detection (ConvergenceMonitor arguments),
+        # the run stops once the reporters levelled off
+        self.convergence = None if convergence is None else ConvergenceMonitor(**convergence)
+        self.converged_at = None
 
         # this is required for the data_collector to work
         self.running = True
@@ -69,71 +143,195 @@ class Friends(Model):
         Runs Schelling model based on grid size, tolerance level and population
         size. Innitializes population (Human agents) and home locations.
         '''
-        schelling = SchellingModel(
+        positions, characters = self.init_layout(tolerance)
+        for (x, y), character in zip(positions.tolist(), characters.tolist()):
+            speed = 1 + (self.streams.setup.random() < self.mobility) * 1
+            self.new_agent((x, y), speed, character)
+
+    def init_layout(self, tolerance):
+        '''
+        Returns home positions and characters after the Schelling model
+        warm-up, which runs from the layout stream. Layouts of seeded runs
+        are looked up in and added to the layout cache.
+        '''
+        if self.layout is not None:
+            return self.layout
+
+        cache = self.layout_cache if self.seed is not None else None
+        if cache is not None:
+            key = cache.key(
+                height=self.height, width=self.width, tolerance=tolerance,
+                population_size=self.population_size, seed=self.seed
+            )
+            layout = cache.load(key)
+            if layout is not None:
+                return layout['positions'], layout['characters']
+
+        schelling = ArraySchellingModel(
             self.height, self.width,
             tolerance,
-            self.population_size
+            self.population_size,
+            seed=self.streams.seed_of('layout')
         )
         for i in range(200):
             schelling.step()
             if not schelling.running:
                 break
-        for ag in schelling.schedule.agents:
-            speed = 1 + (np.random.random() < self.mobility) * 1
-            [x, y] = ag.pos
-            character = ag.character
-            self.new_agent((x, y), speed, character)
 
-    def init_cells(self):
+        if cache is not None:
+            cache.save(key, positions=schelling.positions, characters=schelling.characters)
+        return schelling.positions, schelling.characters
+
+    def checkpoint_agents(self):
+        '''
+        Returns dict of arrays with positions, speeds, travel times,
+        reachable destinations and paths of all agents in state order, and
+        the occupancy index.
+        '''
+        agents = [self.agents_by_id[uid] for uid in self.state.ids]
+        occupants = list(self.occupancy.values())
+        return dict(
+            pos=self.positions(),
+            speed=np.array([agent.speed for agent in agents], dtype=np.int64),
+            max_travel_time=np.array([agent.max_travel_time for agent in agents], dtype=np.int64),
+            reachable=np.concatenate([np.empty(0, dtype=bool)] + [agent.reachable for agent in agents]),
+            waypoints=np.concatenate([np.empty((0, 2), dtype=np.int32)] + [agent._waypoints for agent in agents]),
+            waypoint_counts=np.array([len(agent._waypoints) for agent in agents], dtype=np.int64),
+            cursor=np.array([agent._cursor for agent in agents], dtype=np.int64),
+            occupancy_cells=np.array(list(self.occupancy), dtype=np.int64),
+            occupancy_counts=np.array([len(members) for members in occupants], dtype=np.int64),
+            occupancy_members=np.array([i for members in occupants for i in members], dtype=np.int64)
+        )
+
+    def restore_agents(self, arrays):
+        '''
+        Restores agents and the occupancy index from arrays made by
+        checkpoint_agents.
+        '''
+        agents = [self.agents_by_id[uid] for uid in self.state.ids]
+        waypoint_ends = np.cumsum(arrays['waypoint_counts'])
+        reachable_start = 0
+        for k, agent in enumerate(agents):
+            agent.speed = int(arrays['speed'][k])
+            agent.max_travel_time = int(arrays['max_travel_time'][k])
+            agent.offsets = destination_offsets(agent.speed, agent.max_travel_time)
+            reachable_end = reachable_start + len(agent.offsets)
+            agent.reachable = arrays['reachable'][reachable_start:reachable_end].copy()
+            reachable_start = reachable_end
+            start = waypoint_ends[k] - arrays['waypoint_counts'][k]
+            agent._waypoints = arrays['waypoints'][start:waypoint_ends[k]].copy()
+            agent._cursor = int(arrays['cursor'][k])
+            pos = tuple(arrays['pos'][k].tolist())
+            if pos != agent.pos:
+                self.grid.move_agent(agent, pos)
+
+        members = np.split(arrays['occupancy_members'], np.cumsum(arrays['occupancy_counts'])[:-1])
+        self.occupancy = {
+            cell: occupants.tolist()
+            for cell, occupants in zip(arrays['occupancy_cells'].tolist(), members)
+        }
+
+    def population(self):
+        '''
+        Returns ids, characters and homes of all agents.
+        '''
+        agents = self.schedule.agents
+        return (
+            [ag.unique_id for ag in agents],
+            [ag.character for ag in agents],
+            [ag.home for ag in agents]
+        )
+
+    def positions(self):
         '''
-        Innitializes cell population for grid.
+        Returns current positions of all agents in state order.
         '''
+        agents = [self.agents_by_id[uid] for uid in self.state.ids]
+        return np.array([agent.pos for agent in agents]).reshape(-1, 2)
 
-        # initialize cells and values for model with social hubs.
-        if self.hubs:
-            for _, x, y in self.grid.coord_iter():
-                agent_id = self.next_id()
-                cell = Cell(agent_id, self, (x, y), 0.5)
-                self.grid.place_agent(cell, (x, y))
-        # initialize cells for model without social hubs.
-        else:
-            for _, x, y in self.grid.coord_iter():
-                agent_id = self.next_id()
-                cell = Cell(agent_id, self, (x, y), 0)
-                self.grid.place_agent(cell, (x, y))
+    def init_hubs(self):
+        '''
+        Innitializes cell values for grid.
+        '''
 
-    def init_matrix(self):
+        # cell values start at 0.5 with social hubs and at 0 without
+        value = 0.5 if self.hubs else 0
+        self.hub_values = np.full((self.width, self.height), value, dtype=float)
+
+    def init_occupancy(self):
         '''
-        Creates and returns zeros DataFrame with the Human agent id's used as labels.
+        Builds the occupancy index: cell id to the matrix indices of the
+        Human agents on that cell.
         '''
+        self.occupancy = {}
+        for agent in self.schedule.agents:
+            cell = self.cell_id(agent.pos)
+            self.occupancy.setdefault(cell, []).append(self.state.index[agent.unique_id])
 
-        agents = self.schedule.agents
-        ids = [ag.unique_id for ag in agents if type(ag) is Human]
-        n = len(ids)
-        mat = pd.DataFrame(np.zeros((n, n)), index=ids, columns=ids)
-        return mat
+    def cell_id(self, pos):
+        return pos[0] * self.height + pos[1]
 
-    def init_distances(self):
+    def move_human(self, agent, pos):
+        '''
+        Move Human agent on the grid and in the occupancy index.
+        '''
+        i = self.state.index[agent.unique_id]
+        old = self.cell_id(agent.pos)
+        self.occupancy[old].remove(i)
+        if not self.occupancy[old]:
+            del self.occupancy[old]
+        self.grid.move_agent(agent, pos)
+        self.occupancy.setdefault(self.cell_id(pos), []).append(i)
+
+    def update_hubs(self, positions, scores1, scores2):
         '''
-        Creates and returns two matrices to keep track of social and spatial
-        distances between pairs of Human agents.
+        Update values of the cells at positions to equal the averages of the
+        passed in character scores.
         '''
+        positions = np.asarray(positions).reshape(-1, 2)
+        values = (np.asarray(scores1) + np.asarray(scores2)) / 2
+        self.hub_values[positions[:, 0], positions[:, 1]] = values
 
-        agents = self.schedule.agents
-        processed = []
-        social_distance = self.init_matrix()
-        spatial_distance = self.init_matrix()
-        for ag1 in agents:
-            i = ag1.unique_id
-            for ag2 in agents:
-                j = ag2.unique_id
-                if i != j and j not in processed:
-                    soc_dist = np.abs(ag1.character - ag2.character)
-                    spat_dist = ag1.get_distance(ag2.pos)
-                    social_distance.values[i-1,j-1] = social_distance.values[j-1,i-1] = soc_dist
-                    spatial_distance.values[i-1][j-1] = spatial_distance.values[j-1][i-1] = spat_dist
-            processed.append(i)
-        return [social_distance, spatial_distance]
+    def get_cell(self, pos):
+        '''
+        Returns cell view for position.
+        '''
+        return Cell(self, pos)
+
+    def init_distances(self, tile_size=1024):
+        '''
+        Fills the two matrices that keep track of social and spatial
+        distances between pairs of Human agents, computed from the agents'
+        characters and homes in blocks of tile_size rows.
+        '''
+
+        for rows, social, spatial in self.state.distance_tiles(tile_size):
+            self.state.social_distance[rows] = social
+            self.state.spatial_distance[rows] = spatial
+
+    @property
+    def friends(self):
+        return self.state.frame('friends')  # not used
+
+    @property
+    def friends_score(self):
+        return self.state.frame('friends_score')
+
+    @property
+    def interactions(self):
+        return self.state.frame('interactions')
+
+    @property
+    def last_interaction(self):
+        return self.state.frame('last_interaction')
+
+    @property
+    def social_distance(self):
+        return self.state.frame('social_distance')
+
+    @property
+    def spatial_distance(self):
+        return self.state.frame('spatial_distance')
 
     def new_agent(self, pos, speed, character):
         '''
@@ -144,78 +342,245 @@ class Friends(Model):
         agent = Human(agent_id, self, pos, character, speed)
         self.grid.place_agent(agent, pos)
         self.schedule.add(agent)
+        self.agents_by_id[agent_id] = agent
+
+    @property
+    def M(self):
+        '''
+        Node graph of the population, built in one pass when first used.
+        '''
+        if self._graph is None:
+            # ID and initial pos also used for node graph
+            self._graph = nx.Graph()
+            self._graph.add_nodes_from(
+                (ag.unique_id - 1, {'pos': ag.home, 'speed': ag.speed, 'character': ag.character})
+                for ag in self.agents_by_id.values()
+            )
+        return self._graph
+
+    def friends_of(self, unique_id):
+        '''
+        Returns matrix indices, friends scores, social distances and spatial
+        distances (from current positions) of the friends of an agent.
+        '''
+        agent = self.agents_by_id[unique_id]
+        friends, scores = self.state.scores_of(self.state.index[unique_id])
+        others = [self.agents_by_id[uid] for uid in self.state.ids[friends]]
+        characters = np.array([other.character for other in others])
+        positions = np.array([other.pos for other in others]).reshape(-1, 2)
+
+        social = np.abs(agent.character - characters)
+        spatial = np.abs(positions - np.asarray(agent.pos)).sum(axis=1)
+        return friends, scores, social, spatial
+
+    def friend_stats(self):
+        '''
+        Returns DataFrame with friend count and average friends score, social
+        distance and spatial distance (from current positions) of all agents.
+        '''
+        ids = self.state.ids
+        characters = self.state.characters
+        positions = self.positions()
 
-        # ID and initial pos also used for node graph
-        M = nx.Graph()
-        M.add_node((agent_id-1), pos=pos, speed=speed, character=character)
-        self.M = nx.compose(self.M, M)
+        # all friend pairs at once
+        rows, cols, scores = self.state.friend_pairs()
+        social = np.abs(characters[rows] - characters[cols])
+        spatial = np.abs(positions[rows] - positions[cols]).sum(axis=1)
+
+        n = len(ids)
+        count = np.bincount(cols, minlength=n)
+
+        def average(values):
+            sums = np.bincount(cols, weights=values, minlength=n)
+            return np.divide(sums, count, out=np.zeros(n), where=count > 0)
+
+        return pd.DataFrame(dict(
+            agent_id=ids,
+            friend_count=count,
+            avg_friend_score=average(scores),
+            avg_social_dist=average(social),
+            avg_spatial_dist=average(spatial)
+        ))
 
     def step(self):
         '''
         Execute next time step.
         '''
+        if self.batch_paths:
+            self.plan_trips()
         self.schedule.step()
 
         # friends_score decay functionality
-        val = self.friends_score.values
-        mask_val = self.last_interaction.copy().values
-        val[mask_val != 0] *= self.decay
-        self.last_interaction += 1
+        self.state.decay(self.decay)
 
         # Save the statistics
         self.data_collector.collect(self)
+        self.check_convergence()
+
+    def check_convergence(self):
+        '''
+        Stops the run and records the step once the convergence monitor
+        detects a steady state.
+        '''
+        if self.convergence is not None and self.convergence.update(self):
+            self.running = False
+            self.converged_at = self.convergence.converged_at
+
+    def plan_trips(self):
+        '''
+        Plans the paths of all agents that start a trip or go home this step
+        with one batched call.
+        '''
+        agents = []
+        destinations = []
+        bounds = []
+        for agent in self.schedule.agents:
+            if len(agent.path):
+                continue
+            if agent.is_home():
+                # agents without reachable destinations stay home
+                index = agent.choose_destination()
+                if index is None:
+                    continue
+                destinations.append(agent.offsets[index])
+            else:
+                destinations.append(agent.relative_home_location())
+            bounds.append(agent.get_relative_bounds())
+            agents.append(agent)
+        if not agents:
+            return
+
+        # agents without a path found keep an empty path and plan their own
+        destinations = np.array(destinations)
+        lengths = np.abs(destinations).sum(axis=1) + 2
+        starts = np.zeros_like(destinations)
+        paths, lengths = find_paths(
+            starts, destinations, lengths, bounds,
+            jit=self.jit, rng=self.streams.movement
+        )
+        for agent, path, length in zip(agents, paths, lengths):
+            if length > 0:
+                agent.set_path(path[:length])
 
     def avg_friends_score(self):
         '''
         Return average friends score of population.
         '''
 
-        mat = self.friends_score.copy().values
-        mat[mat == 0] = np.nan
-        try:
-            means = np.nanmean(mat, axis=0)
-            means[np.isnan(means)] = 0
-            mean = np.mean(means)
-        except:
-            mean = 0
-        return mean
+        return self.state.avg_friends_score()
 
     def avg_friends_social_distance(self):
         '''
         Returns average social distance between two friends.
         '''
 
-        check = self.friends_score.copy().values
-        mat = self.social_distance.copy().values
-        mat[check == 0] = np.nan
-        try:
-            means = np.nanmean(mat, axis=0)
-            means[np.isnan(means)] = 0
-            mean = np.mean(means)
-        except:
-            mean = 0
-        return mean
+        return self.state.avg_friends_social_distance()
 
     def avg_friends_spatial_distance(self):
         '''
         Returns average spatial distance between two friends.
         '''
 
-        check = self.friends_score.copy().values
-        mat = self.spatial_distance.copy().values
-        mat[check == 0] = np.nan
+        return self.state.avg_friends_spatial_distance()
+
+    def save_checkpoint(self, path, compressed=True):
+        '''
+        Writes the model state between two steps (agents and paths,
+        relationship state, hub values, random states and the collected
+        reporters) to a .npz file at path, written to a temporary file and
+        renamed into place. Distances, grid and schedule are rebuilt when
+        the checkpoint is loaded.
+        '''
+        reporters = self.data_collector.model_vars
+        meta = dict(
+            model=type(self).__name__,
+            # parameters that may be changed during a run
+            parameters=dict(self.parameters, decay=self.decay, social_extroversion=self.social_extroversion),
+            current_id=self.current_id,
+            steps=self.schedule.steps,
+            time=self.schedule.time,
+            pairs_checked=self.pairs_checked,
+            running=self.running,
+            converged_at=self.converged_at,
+            reporters=list(reporters),
+            random=self.random.getstate(),
+            entropy=self.streams.entropy,
+            streams={
+                name: getattr(self.streams, name).bit_generator.state
+                for name in self.streams.sequences
+            },
+            path_cache=self.path_cache.get_state()
+        )
+        arrays = dict(
+            meta=np.array(json.dumps(meta, default=lambda value: value.item())),
+            homes=self.state.homes,
+            characters=self.state.characters,
+            hub_values=self.hub_values,
+            reporters=np.array([reporters[name] for name in reporters], dtype=float).T
+        )
+        arrays.update(self.checkpoint_agents())
+        arrays.update(('state_' + name, value) for name, value in self.state.checkpoint().items())
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
         try:
-            means = np.nanmean(mat, axis=0)
-            means[np.isnan(means)] = 0
-            mean = np.mean(means)
-        except:
-            mean = 0
-        return mean
+            with os.fdopen(fd, 'wb') as f:
+                (np.savez_compressed if compressed else np.savez)(f, **arrays)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        '''
+        Returns model restored from a checkpoint written by save_checkpoint,
+        it continues exactly like the saved model would have.
+        '''
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        meta = json.loads(str(arrays['meta']))
+        if meta['model'] != cls.__name__:
+            raise ValueError('checkpoint of a %s model cannot be loaded as %s' % (meta['model'], cls.__name__))
+
+        model = cls(layout=(arrays['homes'], arrays['characters']), **meta['parameters'])
+        model.restore(meta, arrays)
+        return model
+
+    def restore(self, meta, arrays):
+        # restores the checkpoint on top of a model built from its layout
+        self.restore_agents(arrays)
+        self.hub_values[...] = arrays['hub_values']
+        self.state.restore({
+            name[len('state_'):]: value
+            for name, value in arrays.items() if name.startswith('state_')
+        })
+
+        self.current_id = meta['current_id']
+        self.schedule.steps = meta['steps']
+        self.schedule.time = meta['time']
+        self.pairs_checked = meta['pairs_checked']
+        self.running = meta['running']
+        self.converged_at = meta['converged_at']
+        if self.convergence is not None:
+            self.convergence.converged_at = meta['converged_at']
+        self.data_collector.model_vars = {
+            name: values.tolist() for name, values in zip(meta['reporters'], arrays['reporters'].T)
+        }
+
+        version, internal, gauss = meta['random']
+        self.random.setstate((version, tuple(internal), gauss))
+        self.streams.entropy = meta['entropy']
+        for name, state in meta['streams'].items():
+            getattr(self.streams, name).bit_generator.state = state
+        self.path_cache.set_state(meta['path_cache'])
 
     def run_model(self, step_count=500):
         '''
-        Runs model.
+        Runs model for step_count steps or until it stops running.
         '''
 
         for i in range(step_count):
+            if not self.running:
+                break
             self.step()
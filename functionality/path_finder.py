@@ -1,111 +1,389 @@
 import numpy as np
-from random import choice
-from functools import reduce
+from collections import OrderedDict
 
+from . import kernels
+from .streams import default_rng
 
-def find_path(start_pos, end_pos, length, bounds=False):
+
+# unit steps indexed by direction: +x, +y, -x, -y
+CARDINALS = [[1, 0], [0, 1], [-1, 0], [0, -1]]
+
+
+def find_path(start_pos, end_pos, length, bounds=False, rng=None):
+    rng = default_rng(rng)
     x = end_pos[0] - start_pos[0]
     y = end_pos[1] - start_pos[1]
     manhattan = np.abs(x) + np.abs(y)
     if (length < manhattan) or (length - manhattan) % 2 != 0:
         return False
+    if out_of_bounds((x, y), bounds):
+        return False
+    # the start position is occupied, paths cannot return to it
+    if length and not manhattan:
+        return False
+    # a self-avoiding path visits length + 1 cells, which have to fit in
+    # the bounds
+    if bounds:
+        cells = (bounds[1][0] - bounds[0][0] + 1) * (bounds[1][1] - bounds[0][1] + 1)
+        if length + 1 > cells:
+            return False
 
-    # all steps that have to be taken for shortest path are added
-    steps = []
-    steps.extend([[int(np.sign(x) * 1), 0] for i in range(np.abs(x))])
-    steps.extend([[0, int(np.sign(y)) * 1] for i in range(np.abs(y))])
+    # number of steps in every direction that have to be taken for
+    # shortest path
+    counts = [max(x, 0), max(y, 0), max(-x, 0), max(-y, 0)]
     missing_steps = length - manhattan
 
-    # if there are extra steps to be taken, those are added
+    # if there are extra steps to be taken, those are added in pairs
+    random_pairs = [0, 0]
     while missing_steps > 0:
-        [all_same, init_step] = moves_of_same_type(steps)
-        if not all_same:
-            if np.random.random() < 0.5:
-                steps.append([1, 0])
-                steps.append([-1, 0])
-            else:
-                steps.append([0, 1])
-                steps.append([0, -1])
+        if not moves_of_same_type(counts):
+            axis = 0 if rng.random() < 0.5 else 1
+            random_pairs[axis] += 1
         else:
-            if init_step[0] == 0:
-                steps.append([1, 0])
-                steps.append([-1, 0])
-            else:
-                steps.append([0, 1])
-                steps.append([0, -1])
+            axis = 1 if counts[0] or counts[2] else 0
+        counts[axis] += 1
+        counts[axis + 2] += 1
         missing_steps -= 2
 
-    # non-overlapping path is constructed given the array of
-    # steps that have to be taken
-    return non_overlapping_path(steps, [], bounds)
-
-
-def non_overlapping_path(steps, path, bounds):
-    remaining = list(map(list, steps))
-    if not len(remaining):
-        return path
-    move_options = possible_options(remaining)
-    while len(move_options):
-        move = choice(move_options)
-        move_options.remove(move)
-        new_path = list(map(list, path))
-        new_path.append(move)
-        not_overlapping = not does_overlap(new_path)
-        if bounds:
-            in_bounds = not out_of_bounds(new_path, bounds)
-        else:
-            in_bounds = True
-        if not_overlapping and in_bounds:
-            try_remaining = list(map(list, remaining))
-            try_remaining.remove(move)
-            found_path = non_overlapping_path(try_remaining, new_path, bounds)
-            if found_path:
-                return found_path
-    return False
+    # non-overlapping path is constructed given the number of
+    # steps that have to be taken in every direction
+    path = non_overlapping_path(counts, (x, y), bounds, rng)
 
+    # if no path exists the randomly placed pairs are tried on the other axis
+    swap = random_pairs[0] - random_pairs[1]
+    if path is False and swap:
+        counts = [counts[0] - swap, counts[1] + swap, counts[2] - swap, counts[3] + swap]
+        path = non_overlapping_path(counts, (x, y), bounds, rng)
+    return path
 
-def moves_of_same_type(steps):
+
+def non_overlapping_path(counts, end, bounds, rng):
+    # depth-first construction of a random self-avoiding path: at every
+    # step one of the remaining directions is picked at random, dead ends
+    # are undone one step at a time
+    remaining = list(counts)
+    length = sum(remaining)
+    end = (int(end[0]), int(end[1]))
+    positions = [(0, 0)]
+    occupied = {(0, 0)}
+    path = []
+    options = [possible_options(remaining)]
+    while len(path) < length:
+        if not options[-1]:
+            options.pop()
+            if not path:
+                return False
+            move = path.pop()
+            occupied.remove(positions.pop())
+            remaining[move] += 1
+            continue
+
+        move = options[-1].pop(rng.integers(len(options[-1])))
+        x, y = positions[-1]
+        pos = (x + CARDINALS[move][0], y + CARDINALS[move][1])
+        if pos in occupied or out_of_bounds(pos, bounds):
+            continue
+        # the end position can only be visited by the last step
+        if pos == end and len(path) + 1 < length:
+            continue
+
+        path.append(move)
+        positions.append(pos)
+        occupied.add(pos)
+        remaining[move] -= 1
+        options.append(possible_options(remaining))
+    return [list(CARDINALS[move]) for move in path]
+
+
+def moves_of_same_type(counts):
     # checks if all moves in path are the same
-    init_step = steps[0]
-    all_same = True
-    for step in steps:
-        if step[0] != init_step[0] or step[1] != init_step[1]:
-            all_same = False
-            break
-    return [all_same, init_step]
+    return sum(1 for count in counts if count) == 1
 
 
 def possible_options(remaining):
     # checks which steps are possible to take
-    cardinals = [[1, 0], [0, 1], [-1, 0], [0, -1]]
-    possible = []
-    for c in cardinals:
-        for dir in remaining:
-            if c[0] == dir[0] and c[1] == dir[1]:
-                possible.append(c)
-                break
-    return possible
-
-
-def does_overlap(steps):
-    # finds out whether the current path is self-overlapping
-    pos = [0, 0]
-    path = [[0, 0]]
-    for step in steps:
-        pos = [
-            pos[0] + step[0],
-            pos[1] + step[1]
-        ]
-        for [x, y] in path:
-            if x == pos[0] and y == pos[1]:
-                return True
-        path.append(pos)
-    return False
-
-
-def out_of_bounds(path, bounds):
-    # checks if the current path goes out of bounds
-    pos = reduce(lambda a, b: [a[0] + b[0], a[1] + b[1]], path)
+    return [move for move, count in enumerate(remaining) if count]
+
+
+def out_of_bounds(pos, bounds):
+    # checks if the position goes out of bounds
+    if not bounds:
+        return False
     x_out = pos[0] < bounds[0][0] or pos[0] > bounds[1][0]
     y_out = pos[1] < bounds[0][1] or pos[1] > bounds[1][1]
     return x_out or y_out
+
+
+# manhattan ring offsets per (speed, max_travel_time), shared by all agents
+DESTINATION_OFFSETS = {}
+
+
+def destination_offsets(speed, max_travel_time):
+    # offsets of all cells at manhattan distance speed up to (not including)
+    # speed * max_travel_time, computed once per pair and read-only
+    key = (int(speed), int(max_travel_time))
+    if key not in DESTINATION_OFFSETS:
+        rings = [ring_offsets(r) for r in range(key[0], key[0] * key[1])]
+        offsets = np.concatenate(rings) if rings else np.empty((0, 2), dtype=np.int32)
+        offsets.flags.writeable = False
+        DESTINATION_OFFSETS[key] = offsets
+    return DESTINATION_OFFSETS[key]
+
+
+def ring_offsets(radius):
+    # offsets of all cells at exactly manhattan distance radius
+    i = np.arange(1, radius + 1)
+    j = radius - i
+    corner = j != 0
+    return np.concatenate([
+        [[0, radius], [0, -radius]],
+        np.stack([i, j], axis=1),
+        np.stack([-i, j], axis=1),
+        np.stack([i, -j], axis=1)[corner],
+        np.stack([-i, -j], axis=1)[corner]
+    ]).astype(np.int32)
+
+
+def detour_feasible(offsets, bounds):
+    # checks for which offsets find_path finds a path of manhattan length + 2
+    # within bounds: the extra pair of steps along an axis needs room outside
+    # the box spanned by start and end on that axis, or a snake which needs
+    # one step on that axis and at least two on the other
+    d = np.asarray(offsets).reshape(-1, 2)
+    lo = np.asarray(bounds[0])
+    hi = np.asarray(bounds[1])
+    inside = ((d >= lo) & (d <= hi)).all(axis=1)
+    room = (lo < np.minimum(d, 0)) | (hi > np.maximum(d, 0))
+    steps = np.abs(d)
+    possible = room | ((steps >= 1) & (steps[:, ::-1] >= 2))
+
+    # straight paths always take their extra pair perpendicular
+    possible[(d[:, 0] != 0) & (d[:, 1] == 0), 0] = False
+    possible[(d[:, 0] == 0) & (d[:, 1] != 0), 1] = False
+    return inside & possible.any(axis=1) & (steps.sum(axis=1) > 0)
+
+
+def clip_bounds(x, y, length, bounds):
+    # clips bounds to the area a path of given length can reach, bounds
+    # further away than that do not change which paths are possible
+    if not bounds:
+        return None
+    extra = (length - np.abs(x) - np.abs(y)) // 2
+    return (
+        (int(max(bounds[0][0], min(0, x) - extra)),
+         int(max(bounds[0][1], min(0, y) - extra))),
+        (int(min(bounds[1][0], max(0, x) + extra)),
+         int(min(bounds[1][1], max(0, y) + extra)))
+    )
+
+
+class PathCache:
+    '''
+    Bounded cache of path templates keyed on the relative destination, path
+    length and clipped bounds. Every key holds a pool of random paths that
+    lookups sample from, least recently used keys are evicted when the
+    cache is full. Paths are generated and sampled with rng.
+    '''
+    def __init__(self, max_size=4096, pool_size=8, rng=None):
+        self.max_size = max_size
+        self.pool_size = pool_size
+        self.rng = default_rng(rng)
+        self.pools = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def find_path(self, start_pos, end_pos, length, bounds=False):
+        '''
+        Returns a random path like find_path, generating new paths until
+        the pool for this key is full and sampling from the pool after.
+        '''
+        x = end_pos[0] - start_pos[0]
+        y = end_pos[1] - start_pos[1]
+        key = (int(x), int(y), int(length), clip_bounds(x, y, length, bounds))
+
+        pool = self.pools.get(key)
+        if pool is None:
+            pool = self.pools[key] = []
+            if len(self.pools) > self.max_size:
+                self.pools.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.pools.move_to_end(key)
+
+        # infeasible keys are stored as a pool holding only None
+        if pool == [None] or len(pool) >= self.pool_size:
+            self.hits += 1
+            path = pool[self.rng.integers(len(pool))]
+        else:
+            self.misses += 1
+            path = find_path([0, 0], [x, y], length, key[3] or False, self.rng)
+            path = None if path is False else tuple(map(tuple, path))
+            if path is None:
+                pool[:] = [None]
+            else:
+                pool.append(path)
+
+        if path is None:
+            return False
+        return [list(step) for step in path]
+
+    def get_state(self):
+        '''
+        Returns the cached pools (in least recently used order), counters
+        and random state as JSON serializable dict.
+        '''
+        return dict(
+            pools=[[list(key), pool] for key, pool in self.pools.items()],
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            rng=self.rng.bit_generator.state
+        )
+
+    def set_state(self, state):
+        '''
+        Restores pools, counters and random state made by get_state.
+        '''
+        self.pools = OrderedDict()
+        for (x, y, length, bounds), pool in state['pools']:
+            if bounds is not None:
+                bounds = tuple(map(tuple, bounds))
+            self.pools[(x, y, length, bounds)] = [
+                None if path is None else tuple(map(tuple, path)) for path in pool
+            ]
+        self.hits = state['hits']
+        self.misses = state['misses']
+        self.evictions = state['evictions']
+        self.rng.bit_generator.state = state['rng']
+
+    def stats(self):
+        '''
+        Returns hit/miss counters and the current number of cached keys.
+        '''
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=self.hits / lookups if lookups else 0,
+            size=len(self.pools)
+        )
+
+
+# unit steps as array, the last row is the zero step used for padding
+DIRECTIONS = np.array(CARDINALS + [[0, 0]], dtype=np.int8)
+
+
+def find_paths(starts, ends, lengths, bounds=None, max_rounds=10, jit=False, rng=None):
+    '''
+    Batched version of find_path for K paths at once. Starts, ends and
+    bounds ([[min_x, min_y], [max_x, max_y]] per row) share one coordinate
+    frame. Returns a zero padded int8 array of steps with shape
+    (K, max_length, 2) and the path lengths, -1 where no path was found.
+
+    Step orders are drawn as random permutations of every row's steps and
+    rows that overlap or leave the bounds are redrawn; rows still invalid
+    after max_rounds fall back to find_path. With jit the redraws run in a
+    compiled kernel when numba is available. Random numbers are drawn
+    from rng.
+    '''
+    rng = default_rng(rng)
+    starts = np.asarray(starts, dtype=np.int64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.int64).reshape(-1, 2)
+    lengths = np.asarray(lengths, dtype=np.int64).reshape(-1)
+    if bounds is not None:
+        bounds = np.asarray(bounds, dtype=np.int64).reshape(-1, 2, 2)
+
+    d = ends - starts
+    manhattan = np.abs(d).sum(axis=1)
+    feasible = (lengths >= manhattan) & ((lengths - manhattan) % 2 == 0)
+    if bounds is not None:
+        feasible &= (ends >= bounds[:, 0]).all(axis=1)
+        feasible &= (ends <= bounds[:, 1]).all(axis=1)
+    max_length = int(lengths[feasible].max()) if feasible.any() else 0
+    paths = np.zeros((len(lengths), max_length, 2), dtype=np.int8)
+    path_lengths = np.where(feasible, lengths, -1)
+
+    # steps in every direction for the shortest path plus the extra pairs,
+    # straight paths get their first extra pair perpendicular like find_path
+    counts = np.stack([
+        np.maximum(d[:, 0], 0), np.maximum(d[:, 1], 0),
+        np.maximum(-d[:, 0], 0), np.maximum(-d[:, 1], 0)
+    ], axis=1)
+    pairs = np.where(feasible, (lengths - manhattan) // 2, 0)
+    along_x = (d[:, 0] != 0) & (d[:, 1] == 0)
+    along_y = (d[:, 0] == 0) & (d[:, 1] != 0)
+    forced = (pairs > 0) & (along_x | along_y)
+    x_pairs = rng.binomial(pairs - forced, 0.5) + (forced & along_y)
+    y_pairs = pairs - x_pairs
+    counts[:, [0, 2]] += x_pairs[:, None]
+    counts[:, [1, 3]] += y_pairs[:, None]
+
+    todo = np.flatnonzero(feasible & (lengths > 0))
+    if jit and kernels.AVAILABLE and len(todo):
+        # compiled redraws are cheap, rows get ten times as many
+        has_bounds = bounds is not None
+        row_bounds = bounds[todo] if has_bounds else np.zeros((len(todo), 2, 2), dtype=np.int64)
+        found, valid = kernels.shuffle_paths(
+            counts[todo], starts[todo], lengths[todo], row_bounds, has_bounds,
+            max_length, rng.integers(2 ** 31), 10 * max_rounds
+        )
+        paths[todo[valid]] = found[valid]
+        todo = todo[~valid]
+        max_rounds = 0
+
+    for _ in range(max_rounds):
+        if not len(todo):
+            break
+        codes = random_step_orders(counts[todo], max_length, rng)
+        row_bounds = None if bounds is None else bounds[todo]
+        valid = valid_step_orders(starts[todo], codes, lengths[todo], row_bounds)
+        paths[todo[valid]] = DIRECTIONS[codes[valid]]
+        todo = todo[~valid]
+
+    # rows without a valid order are left to the depth-first search
+    for i in todo:
+        row_bounds = False if bounds is None else (bounds[i] - starts[i]).tolist()
+        path = find_path([0, 0], d[i], lengths[i], row_bounds, rng)
+        if path is False:
+            path_lengths[i] = -1
+        else:
+            paths[i, :len(path)] = path
+    return paths, path_lengths
+
+
+def random_step_orders(counts, max_length, rng):
+    # random permutation of every row's steps as direction codes, padded
+    # with the zero step code
+    cumulative = np.cumsum(counts, axis=1)
+    index = np.arange(max_length)
+    codes = (index[None, :, None] >= cumulative[:, None, :]).sum(axis=2)
+    keys = rng.random(codes.shape)
+    keys[codes == len(CARDINALS)] = 2
+    order = np.argsort(keys, axis=1)
+    return np.take_along_axis(codes, order, axis=1)
+
+
+def valid_step_orders(starts, codes, lengths, bounds):
+    # checks which step orders are self-avoiding and stay within bounds
+    steps = DIRECTIONS[codes].astype(np.int64)
+    pos = np.concatenate([
+        np.zeros((len(codes), 1, 2), dtype=np.int64),
+        np.cumsum(steps, axis=1)
+    ], axis=1)
+
+    valid = np.ones(len(codes), dtype=bool)
+    if bounds is not None:
+        absolute = pos + starts[:, None, :]
+        valid &= (absolute >= bounds[:, None, 0]).all(axis=(1, 2))
+        valid &= (absolute <= bounds[:, None, 1]).all(axis=(1, 2))
+
+    # positions after the end of a path get unique negative ids
+    span = 2 * codes.shape[1] + 1
+    ids = (pos[:, :, 0] + codes.shape[1]) * span + pos[:, :, 1] + codes.shape[1]
+    padding = np.arange(codes.shape[1] + 1)[None, :] > lengths[:, None]
+    ids[padding] = -1 - np.nonzero(padding)[1]
+    ids.sort(axis=1)
+    valid &= ~(np.diff(ids, axis=1) == 0).any(axis=1)
+    return valid
@@ -0,0 +1,43 @@
+import pandas as pd
+
+from .model import Friends
+
+
+# hubs on/off and mobility variants of main.main
+SCENARIOS = {
+    'hubs': dict(hubs=True, mobility=0.5),
+    'no hubs': dict(hubs=False, mobility=0.5),
+    'hubs, no mobility': dict(hubs=True, mobility=0),
+    'no hubs, no mobility': dict(hubs=False, mobility=0)
+}
+
+
+def run_paired(scenarios=SCENARIOS, seeds=range(10), step_count=500, model=Friends, **params):
+    '''
+    Runs every scenario (model parameters by name, on top of params) once
+    per seed with common random numbers: runs with the same seed draw from
+    the same random streams, so scenarios are compared per seed and
+    differences need far fewer replicates than independent runs. Returns
+    DataFrame of the model reporters per scenario, seed and step.
+    '''
+    frames = []
+    for seed in seeds:
+        for name, scenario in scenarios.items():
+            md = model(seed=seed, **dict(params, **scenario))
+            md.run_model(step_count)
+            df = md.data_collector.get_model_vars_dataframe()
+            df.index.name = 'step'
+            frames.append(df.assign(scenario=name, seed=seed).reset_index())
+    return pd.concat(frames, ignore_index=True).set_index(['scenario', 'seed', 'step'])
+
+
+def paired_differences(results, baseline, step=None):
+    '''
+    Returns DataFrame of the reporter differences at step (the last step by
+    default) between every scenario and the baseline scenario, per seed.
+    '''
+    if step is None:
+        step = results.index.get_level_values('step').max()
+    final = results.xs(step, level='step')
+    differences = final.sub(final.xs(baseline, level='scenario'), level='seed')
+    return differences.drop(baseline, level='scenario')
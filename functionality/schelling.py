@@ -4,12 +4,14 @@ from mesa import Model, Agent
 from mesa.time import RandomActivation
 from mesa.space import SingleGrid
 
+from .helpers import sample_positions
+
 
 class SchellingAgent(Agent):
     def __init__(self, pos, model):
         super().__init__(pos, model)
         self.pos = pos
-        self.character = np.random.random()
+        self.character = model.rng.random()
         self.did_move = True
 
     def step(self):
@@ -36,7 +38,10 @@ class SchellingAgent(Agent):
 
 class SchellingModel(Model):
 
-    def __init__(self, height=20, width=20, tolerance=0.3, population=200):
+    def __init__(self, height=20, width=20, tolerance=0.3, population=200, seed=None):
+        # seed is used by Model to seed self.random and for the NumPy
+        # generator of the setup
+        self.rng = np.random.default_rng(seed)
         self.height = height
         self.width = width
         self.tolerance = tolerance
@@ -49,16 +54,10 @@ class SchellingModel(Model):
         self.setup()
 
     def setup(self):
-        occupied = []
-        for i in range(self.population):
-            x = np.random.randint(0, self.width)
-            y = np.random.randint(0, self.height)
-            while [x, y] in occupied:
-                x = np.random.randint(0, self.width)
-                y = np.random.randint(0, self.height)
-            occupied.append([x, y])
+        positions = sample_positions(self.grid.width, self.grid.height, self.population, self.rng)
+        for x, y in positions.tolist():
             agent = SchellingAgent((x, y), self)
-            self.grid.position_agent(agent, (x, y))
+            self.grid.position_agent(agent, x, y)
             self.schedule.add(agent)
 
     def happy_ratio(self):
@@ -72,6 +71,143 @@ class SchellingModel(Model):
             self.running = False
 
 
+class ArraySchellingModel(Model):
+    '''
+    Schelling model that keeps characters and occupancy in flat arrays (on a
+    grid padded with one empty cell on every side) instead of agents on a
+    SingleGrid. The fit of a cell is computed from the 8 shifted neighbour
+    cells, for all empty cells at once. Runs step for step like
+    SchellingModel: agents step in random order and an unhappy agent moves
+    to the first empty cell, in the order of the grid's empties list, that
+    fits better.
+    '''
+
+    # neighbour offsets in the order the grid iterates them
+    NEIGHBORS = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx or dy]
+
+    def __init__(self, height=20, width=20, tolerance=0.3, population=200, seed=None):
+        # seed is used by Model to seed self.random and for the NumPy
+        # generator of the setup
+        self.rng = np.random.default_rng(seed)
+        self.height = height
+        self.width = width
+        self.tolerance = tolerance
+        self.population = population
+        self.happy = 0
+
+        # same dimensions as the SingleGrid(height, width) of SchellingModel
+        self.grid_width = height
+        self.grid_height = width
+        self.stride = self.grid_height + 2
+        size = (self.grid_width + 2) * self.stride
+        self.values = np.zeros(size)
+        self.occupied = np.zeros(size)
+        self.offsets = np.array([dx * self.stride + dy for dx, dy in self.NEIGHBORS])
+        self.running = True
+        self.setup()
+
+    def setup(self):
+        positions = sample_positions(self.grid_width, self.grid_height, self.population, self.rng)
+        self.characters = self.rng.random(self.population)
+        self.cells = self.flat(positions)
+        self.values[self.cells] = self.characters
+        self.occupied[self.cells] = 1
+
+        # empty cells in the order of the grid's empties list
+        empty = np.ones((self.grid_width, self.grid_height), dtype=bool)
+        empty[positions[:, 0], positions[:, 1]] = False
+        self.empties = self.flat(np.argwhere(empty))
+
+    def flat(self, positions):
+        # flat index in the padded grid
+        return (positions[:, 0] + 1) * self.stride + positions[:, 1] + 1
+
+    @property
+    def positions(self):
+        '''
+        Returns current (x, y) positions of all agents.
+        '''
+        return np.stack([self.cells // self.stride - 1, self.cells % self.stride - 1], axis=1)
+
+    def fit(self, cells, character):
+        '''
+        Returns average character distance to the 8 neighbours of every cell,
+        empty neighbours count as 0. Character is one score or one per cell.
+        '''
+        neighbors = cells[:, None] + self.offsets
+        character = np.asarray(character)[..., None]
+        distance = np.abs(self.values[neighbors] - character) * self.occupied[neighbors]
+
+        # summed in neighbour order, like the agent based model
+        return np.cumsum(distance, axis=1)[:, -1] / 8
+
+    def first_better(self, character, current):
+        '''
+        Returns index of the first empty cell that fits better than current,
+        None if there is none. Empties are scanned in growing chunks since a
+        better cell is usually found early.
+        '''
+        start = 0
+        chunk = 64
+        while start < len(self.empties):
+            fits = self.fit(self.empties[start:start + chunk], character)
+            better = np.flatnonzero(fits < current)
+            if len(better):
+                return start + better[0]
+            start += chunk
+            chunk *= 4
+        return None
+
+    def move(self, agent, index):
+        '''
+        Move agent to the empty cell at index in empties.
+        '''
+        old = self.cells[agent]
+        new = self.empties[index]
+        self.values[new] = self.characters[agent]
+        self.occupied[new] = 1
+        self.values[old] = 0
+        self.occupied[old] = 0
+        self.cells[agent] = new
+        self.changed[old + self.offsets] = True
+        self.changed[new + self.offsets] = True
+
+        # like the grid's list, the new cell is removed and the old appended
+        self.empties[index:-1] = self.empties[index + 1:]
+        self.empties[-1] = old
+
+    def agent_step(self, agent, current):
+        # the fit is recomputed if a neighbour moved earlier this step
+        character = self.characters[agent]
+        if self.changed[self.cells[agent]]:
+            current = self.fit(self.cells[agent:agent + 1], character)[0]
+        if current > self.tolerance:
+            index = self.first_better(character, current)
+            if index is not None:
+                self.move(agent, index)
+        else:
+            self.happy += 1
+
+    def happy_ratio(self):
+        return self.happy / len(self.cells)
+
+    def step(self):
+        self.happy = 0  # Reset counter of happy agents
+
+        # fits of all agents at the start of the step and cells whose
+        # neighbourhood changed since
+        fits = self.fit(self.cells, self.characters)
+        self.changed = np.zeros(len(self.values), dtype=bool)
+
+        # random activation order
+        order = list(range(len(self.cells)))
+        self.random.shuffle(order)
+        for agent in order:
+            self.agent_step(agent, fits[agent])
+        if self.happy_ratio() > 0.99:
+            self.running = False
+
+
 if __name__ == '__main__':
     md = SchellingModel(20, 20, 0.3, 200)
     for i in range(200):
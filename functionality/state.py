@@ -0,0 +1,705 @@
+import numpy as np
+import pandas as pd
+
+from . import kernels
+
+
+# smallest positive float, scores below it underflow to zero
+TINY = np.nextafter(0, 1)
+
+
+def steps_to_zero(scores, rate):
+    '''
+    Returns for every score the number of decays (score * rate ** k) after
+    which it underflows to zero, -1 for scores that never reach zero.
+    '''
+    scores = np.atleast_1d(np.asarray(scores, dtype=float))
+    if rate >= 1:
+        return np.full(scores.shape, -1, dtype=np.int64)
+    if rate <= 0:
+        return np.ones(scores.shape, dtype=np.int64)
+
+    # bisection on the number of decays, rate ** steps itself underflows
+    # to zero above the upper bound
+    lower = np.zeros(scores.shape, dtype=np.int64)
+    upper = np.full(scores.shape, int((np.log(TINY) - np.log(2)) / np.log(rate)) + 2)
+    while (scores * np.power(rate, upper) != 0).any():
+        upper *= 2
+    while True:
+        open_ = upper - lower > 1
+        if not open_.any():
+            return upper
+        middle = (lower + upper) // 2
+        zero = scores * np.power(rate, middle) == 0
+        upper = np.where(open_ & zero, middle, upper)
+        lower = np.where(open_ & ~zero, middle, lower)
+
+
+def pair_arrays(pairs, dtype):
+    # keys ((i, j) pairs) and values of a pair dictionary as arrays
+    keys = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+    values = np.fromiter(pairs.values(), dtype=dtype, count=len(keys))
+    return keys, values
+
+
+class FriendshipState:
+    '''
+    Relationship state between Human agents (friends, friends scores,
+    interaction counts and time since last interaction). Agent id's are
+    mapped to contiguous indices, social and spatial distances are derived
+    from the agents' characters and home locations.
+
+    Friend counts and the sums of friends scores, social distances and
+    spatial distances over every agent's friends are kept up to date as
+    scores change, so the population averages are O(N) reads. With debug
+    set they are cross-checked against the full recomputation.
+
+    With lazy_decay set to the decay rate, friends scores are only decayed
+    when they are read or updated (rate ** ticks since last interaction),
+    so a decay step costs O(interactions) instead of O(pairs). Pairs are
+    scheduled to be dropped at the tick their score underflows to zero.
+    '''
+
+    matrices = [
+        'friends', 'friends_score', 'interactions',
+        'last_interaction', 'social_distance', 'spatial_distance'
+    ]
+
+    def __init__(self, ids, characters, homes, lazy_decay=None):
+        self.ids = np.asarray(ids)
+        self.index = {uid: i for i, uid in enumerate(ids)}
+        self.characters = np.asarray(characters, dtype=float)
+        self.homes = np.asarray(homes).reshape(-1, 2)
+        self.tick = 0
+
+        # running per-agent statistics and pairs touched since last decay
+        n = len(self.ids)
+        self.friend_count = np.zeros(n, dtype=np.int64)
+        self.score_sum = np.zeros(n)
+        self.social_sum = np.zeros(n)
+        self.spatial_sum = np.zeros(n)
+        self.touched = set()
+        self.debug = False
+
+        # use the compiled kernels (only set when numba is available)
+        self.jit = False
+
+        # lazy decay rate, tick of last materialization, scheduled drops and
+        # pairs updated this tick that still need to be scheduled
+        self.lazy = lazy_decay is not None
+        self.rate = lazy_decay
+        self.rebased = 0
+        self.expiry = {}
+        self.pending = []
+
+    def social_distances(self, rows, cols):
+        '''
+        Returns social distances between agents with indices rows and cols.
+        '''
+        return np.abs(self.characters[rows] - self.characters[cols])
+
+    def spatial_distances(self, rows, cols):
+        '''
+        Returns spatial distances between the homes of agents with indices
+        rows and cols.
+        '''
+        return np.abs(self.homes[rows] - self.homes[cols]).sum(axis=1)
+
+    def distance_tiles(self, tile_size=1024):
+        '''
+        Yields blocks of tile_size rows with the social and spatial distances
+        of those agents to all agents, so temporary arrays stay at most
+        tile_size x N.
+        '''
+        for start in range(0, len(self.ids), tile_size):
+            rows = slice(start, start + tile_size)
+            social = np.abs(self.characters[rows, None] - self.characters[None, :])
+            spatial = np.abs(self.homes[rows, None] - self.homes[None, :]).sum(axis=2)
+            yield rows, social, spatial
+
+    def update_stats(self, i, j, old, new):
+        '''
+        Update running statistics for a friends score of agents with indices
+        i and j that changed from old to new.
+        '''
+        self.touched.add((min(i, j), max(i, j)))
+        if new and not old:
+            self.change_friends([i], [j], 1)
+        elif old and not new:
+            self.change_friends([i], [j], -1)
+        self.score_sum[i] += new - old
+        self.score_sum[j] += new - old
+
+    def update_stats_many(self, rows, cols, old, scores):
+        '''
+        Batch version of update_stats for unique pairs with indices rows < cols.
+        '''
+        self.touched.update(zip(rows.tolist(), cols.tolist()))
+        gained = (scores != 0) & (old == 0)
+        lost = (scores == 0) & (old != 0)
+        self.change_friends(rows[gained], cols[gained], 1)
+        self.change_friends(rows[lost], cols[lost], -1)
+        np.add.at(self.score_sum, rows, scores - old)
+        np.add.at(self.score_sum, cols, scores - old)
+
+    def count_many(self, rows, cols):
+        '''
+        Batch version of count_interaction.
+        '''
+        for i, j in zip(np.asarray(rows).tolist(), np.asarray(cols).tolist()):
+            self.count_interaction(i, j)
+
+    def merge_pairs(self, rows, cols, amounts):
+        # unique (i, j) pairs with i < j and the summed amounts per pair
+        n = len(self.ids)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        keys = np.minimum(rows, cols) * n + np.maximum(rows, cols)
+        keys, inverse = np.unique(keys, return_inverse=True)
+        amounts = np.bincount(inverse, weights=amounts, minlength=len(keys))
+        return keys // n, keys % n, amounts
+
+    def change_friends(self, rows, cols, sign):
+        '''
+        Add (sign 1) or remove (sign -1) friend pairs to the running counts
+        and distance sums.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        social = sign * self.social_distances(rows, cols)
+        spatial = sign * self.spatial_distances(rows, cols)
+        for a in (rows, cols):
+            np.add.at(self.friend_count, a, sign)
+            np.add.at(self.social_sum, a, social)
+            np.add.at(self.spatial_sum, a, spatial)
+
+    def decay_factor(self, last):
+        '''
+        Returns lazy decay factor for scores last touched at tick last.
+        '''
+        if not self.lazy:
+            return 1.0
+        last = np.asarray(last)
+        elapsed = np.maximum(self.tick - np.maximum(last + 1, self.rebased), 0)
+        return np.power(self.rate, elapsed)
+
+    def schedule_expiry(self, rows, cols, last, scores):
+        '''
+        Schedules pairs to be dropped at the tick their lazily decayed
+        score reaches zero.
+        '''
+        if not self.lazy:
+            return
+        nonzero = np.asarray(scores) != 0
+        rows, cols = np.asarray(rows)[nonzero], np.asarray(cols)[nonzero]
+        last, scores = np.asarray(last)[nonzero], np.asarray(scores)[nonzero]
+        valid_from = np.maximum(np.asarray(last) + 1, self.rebased)
+        steps = steps_to_zero(scores, self.rate)
+        for i, j, t, tick in zip(rows, cols, last, valid_from + steps):
+            if tick > self.tick:
+                self.expiry.setdefault(int(tick), []).append((int(i), int(j), int(t)))
+
+    def defer_expiry(self, rows, cols, scores):
+        # pairs updated this tick are scheduled together at the decay step
+        if self.lazy:
+            self.pending.extend(zip(rows, cols, scores))
+
+    def lazy_decay_step(self, decay):
+        '''
+        Advances one tick with lazy decay, only pairs whose score reaches
+        zero this tick are visited.
+        '''
+        if self.pending:
+            pending = np.array(self.pending).reshape(-1, 3)
+            rows, cols = pending[:, 0].astype(np.int64), pending[:, 1].astype(np.int64)
+            self.schedule_expiry(rows, cols, np.full(len(rows), self.tick), pending[:, 2])
+            self.pending = []
+        if decay != self.rate:
+            self.materialize()
+            self.rate = decay
+            self.expiry = {}
+            rows, cols, scores, last = self.stored_pairs()
+            self.schedule_expiry(rows, cols, last, scores)
+        self.tick += 1
+
+        lost = []
+        for i, j, last in self.expiry.pop(self.tick, ()):
+            stale = self.touched_at(i, j) != last or not self.stored(i, j)
+            if not stale and self.score(i, j) == 0:
+                self.remove_pair(i, j)
+                lost.append((i, j))
+        lost = np.array(lost, dtype=np.int64).reshape(-1, 2)
+        self.change_friends(lost[:, 0], lost[:, 1], -1)
+        self.decay_stats(decay)
+
+    def materialize(self):
+        '''
+        Applies pending lazy decay to all stored friends scores (for
+        reporting), pairs that reached zero are dropped.
+        '''
+        if not self.lazy:
+            return
+        rows, cols, scores, last = self.stored_pairs()
+        scores = scores * self.decay_factor(last)
+        self.set_scores(rows, cols, scores)
+        lost = scores == 0
+        for i, j in zip(rows[lost], cols[lost]):
+            self.remove_pair(i, j)
+        self.change_friends(rows[lost], cols[lost], -1)
+
+        self.rebased = self.tick
+        self.expiry = {}
+        self.pending = []
+        keep = ~lost
+        self.schedule_expiry(rows[keep], cols[keep], last[keep], scores[keep])
+
+    def decay_stats(self, decay):
+        '''
+        Decay the running score sums, the scores of all pairs except the
+        ones touched since the last decay were multiplied by decay.
+        '''
+        pairs = np.array(list(self.touched), dtype=np.int64).reshape(-1, 2)
+        scores = self.pair_scores(pairs[:, 0], pairs[:, 1])
+        kept = np.zeros(len(self.ids))
+        np.add.at(kept, pairs[:, 0], scores)
+        np.add.at(kept, pairs[:, 1], scores)
+        self.score_sum = decay * self.score_sum + (1 - decay) * kept
+        self.score_sum[self.friend_count == 0] = 0
+        self.touched.clear()
+
+    def pair_scores(self, rows, cols):
+        '''
+        Returns friends scores of the pairs of agents with indices rows and
+        cols.
+        '''
+        return np.array([self.score(i, j) for i, j in zip(rows, cols)], dtype=float)
+
+    def average_sums(self, sums):
+        '''
+        Returns average over all agents of a running sum over each agent's
+        friends divided by its friend count (0 for agents without friends).
+        '''
+        n = len(self.ids)
+        if not n:
+            return 0
+        count = self.friend_count
+        if self.jit:
+            return kernels.average_sums(sums, count)
+        return np.mean(np.divide(sums, count, out=np.zeros(n), where=count > 0))
+
+    def average_over_friends(self, cols, values):
+        '''
+        Returns average over all agents of the mean of values over each
+        agent's friends (0 for agents without friends), recomputed from all
+        friend pairs.
+        '''
+        n = len(self.ids)
+        if not n:
+            return 0
+        count = np.bincount(cols, minlength=n)
+        sums = np.bincount(cols, weights=values, minlength=n)
+        return np.mean(np.divide(sums, count, out=np.zeros(n), where=count > 0))
+
+    def checkpoint(self):
+        '''
+        Returns dict of arrays with the relationship state between two
+        steps, for restore.
+        '''
+        expiry = [
+            (tick, i, j, last)
+            for tick, pairs in self.expiry.items() for i, j, last in pairs
+        ]
+        arrays = dict(
+            tick=np.array(self.tick),
+            rate=np.array(np.nan if self.rate is None else self.rate),
+            rebased=np.array(self.rebased),
+            expiry=np.array(expiry, dtype=np.int64).reshape(-1, 4),
+            friend_count=self.friend_count,
+            score_sum=self.score_sum,
+            social_sum=self.social_sum,
+            spatial_sum=self.spatial_sum
+        )
+        arrays.update(self.checkpoint_pairs())
+        return arrays
+
+    def restore(self, arrays):
+        '''
+        Restores the relationship state from arrays made by checkpoint.
+        '''
+        self.tick = int(arrays['tick'])
+        if self.lazy:
+            self.rate = float(arrays['rate'])
+        self.rebased = int(arrays['rebased'])
+        self.expiry = {}
+        for tick, i, j, last in arrays['expiry'].tolist():
+            self.expiry.setdefault(tick, []).append((i, j, last))
+        self.pending = []
+        self.touched = set()
+        for name in ('friend_count', 'score_sum', 'social_sum', 'spatial_sum'):
+            setattr(self, name, arrays[name].copy())
+        self.restore_pairs(arrays)
+
+    def check(self, value, full):
+        # cross-check of a running statistic in debug mode
+        if self.debug:
+            np.testing.assert_allclose(value, full(), rtol=1e-7, atol=1e-12)
+        return value
+
+    def avg_friends_score(self):
+        def full():
+            _, cols, scores = self.friend_pairs()
+            return self.average_over_friends(cols, scores)
+        return self.check(self.average_sums(self.score_sum), full)
+
+    def avg_friends_social_distance(self):
+        def full():
+            rows, cols, _ = self.friend_pairs()
+            return self.average_over_friends(cols, self.social_distances(rows, cols))
+        return self.check(self.average_sums(self.social_sum), full)
+
+    def avg_friends_spatial_distance(self):
+        def full():
+            rows, cols, _ = self.friend_pairs()
+            return self.average_over_friends(cols, self.spatial_distances(rows, cols))
+        return self.check(self.average_sums(self.spatial_sum), full)
+
+
+class DenseState(FriendshipState):
+    '''
+    Relationship state kept in dense N x N NumPy matrices, the time since
+    last interaction is stored as the tick of the last interaction.
+    '''
+
+    def __init__(self, ids, characters, homes, lazy_decay=None):
+        super().__init__(ids, characters, homes, lazy_decay)
+        n = len(ids)
+        for name in self.matrices:
+            if name != 'last_interaction':
+                setattr(self, name, np.zeros((n, n)))
+        self.last_touched = np.zeros((n, n), dtype=np.int64)
+
+    def interact(self, i, j, amount):
+        '''
+        Reset time since last interaction and add amount to the friends score
+        of agents with indices i and j.
+        '''
+        old = self.score(i, j)
+        score = old + amount
+        self.friends_score[i, j] = self.friends_score[j, i] = score
+        self.last_touched[i, j] = self.last_touched[j, i] = self.tick
+        self.update_stats(i, j, old, score)
+        self.defer_expiry([i], [j], [score])
+
+    def count_interaction(self, i, j):
+        '''
+        Count interaction of agents with indices i and j.
+        '''
+        self.interactions[min(i, j), max(i, j)] += 1
+
+    def interact_many(self, rows, cols, amounts):
+        '''
+        Batch version of interact, repeated pairs add up their amounts.
+        '''
+        rows, cols, amounts = self.merge_pairs(rows, cols, amounts)
+        old = self.pair_scores(rows, cols)
+        scores = old + amounts
+        self.friends_score[rows, cols] = self.friends_score[cols, rows] = scores
+        self.last_touched[rows, cols] = self.last_touched[cols, rows] = self.tick
+
+        self.update_stats_many(rows, cols, old, scores)
+        self.defer_expiry(rows.tolist(), cols.tolist(), scores.tolist())
+
+    def count_many(self, rows, cols):
+        '''
+        Batch version of count_interaction.
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        np.add.at(self.interactions, (np.minimum(rows, cols), np.maximum(rows, cols)), 1)
+
+    def decay(self, decay):
+        '''
+        Decay friends scores of all pairs that did not interact since the
+        last decay and advance time since last interaction.
+        '''
+        if self.lazy:
+            return self.lazy_decay_step(decay)
+
+        if self.jit:
+            rows, cols = kernels.decay_dense(self.friends_score, self.last_touched, self.tick, decay)
+        else:
+            scores = self.friends_score
+            mask = (self.last_touched != self.tick) & (scores != 0)
+            scores[mask] *= decay
+            rows, cols = np.nonzero(mask & (scores == 0))
+            upper = rows < cols
+            rows, cols = rows[upper], cols[upper]
+        self.tick += 1
+
+        # pairs whose score decayed to zero are no longer friends
+        self.change_friends(rows, cols, -1)
+        self.decay_stats(decay)
+
+    def score(self, i, j):
+        return self.friends_score[i, j] * self.decay_factor(self.last_touched[i, j])
+
+    def pair_scores(self, rows, cols):
+        return self.friends_score[rows, cols] * self.decay_factor(self.last_touched[rows, cols])
+
+    def touched_at(self, i, j):
+        return self.last_touched[i, j]
+
+    def stored(self, i, j):
+        return self.friends_score[i, j] != 0
+
+    def stored_pairs(self):
+        # pairs with a stored nonzero score, each pair once
+        rows, cols = np.nonzero(self.friends_score)
+        upper = rows < cols
+        rows, cols = rows[upper], cols[upper]
+        return rows, cols, self.friends_score[rows, cols], self.last_touched[rows, cols]
+
+    def set_scores(self, rows, cols, scores):
+        self.friends_score[rows, cols] = self.friends_score[cols, rows] = scores
+
+    def remove_pair(self, i, j):
+        self.friends_score[i, j] = self.friends_score[j, i] = 0
+
+    def friend_pairs(self):
+        '''
+        Returns row indices, column indices and scores of all nonzero
+        friends scores (every pair in both directions).
+        '''
+        rows, cols = np.nonzero(self.friends_score)
+        scores = self.friends_score[rows, cols]
+        if self.lazy:
+            scores = scores * self.decay_factor(self.last_touched[rows, cols])
+            nonzero = scores != 0
+            rows, cols, scores = rows[nonzero], cols[nonzero], scores[nonzero]
+        return rows, cols, scores
+
+    def scores_of(self, i):
+        '''
+        Returns indices and friends scores of the friends of agent i.
+        '''
+        scores = self.friends_score[:, i] * self.decay_factor(self.last_touched[:, i])
+        friends = np.flatnonzero(scores > 0)
+        return friends, scores[friends]
+
+    def nr_friends(self, i):
+        return np.sum(self.friends[:, i]) + np.sum(self.friends[i])
+
+    def checkpoint_pairs(self):
+        return dict(
+            friends_score=self.friends_score,
+            interactions=self.interactions,
+            last_touched=self.last_touched
+        )
+
+    def restore_pairs(self, arrays):
+        for name in ('friends_score', 'interactions', 'last_touched'):
+            getattr(self, name)[...] = arrays[name]
+
+    def frame(self, name):
+        '''
+        Returns DataFrame view of matrix with the agent id's used as labels.
+        '''
+        if name == 'last_interaction':
+            mat = (self.tick - self.last_touched).astype(float)
+        else:
+            if name == 'friends_score':
+                self.materialize()
+            mat = getattr(self, name)
+        return pd.DataFrame(mat, index=self.ids, columns=self.ids)
+
+
+class SparseState(FriendshipState):
+    '''
+    Relationship state kept in dictionaries keyed on (i, j) index pairs with
+    i < j, so memory grows with the number of pairs that ever interacted.
+    The time since last interaction is stored as the tick of the last
+    interaction.
+    '''
+
+    def __init__(self, ids, characters, homes, lazy_decay=None):
+        super().__init__(ids, characters, homes, lazy_decay)
+        self.friends = {}  # not used
+        self.friends_score = {}
+        self.interactions = {}
+        self.last_interaction = {}
+        self.partners = {}
+
+    def interact(self, i, j, amount):
+        '''
+        Reset time since last interaction and add amount to the friends score
+        of agents with indices i and j.
+        '''
+        key = (min(i, j), max(i, j))
+        old = self.score(i, j)
+        score = old + amount
+        self.last_interaction[key] = self.tick
+        if score:
+            self.friends_score[key] = score
+            self.partners.setdefault(i, set()).add(j)
+            self.partners.setdefault(j, set()).add(i)
+        self.update_stats(i, j, old, score)
+        self.defer_expiry([key[0]], [key[1]], [score])
+
+    def count_interaction(self, i, j):
+        '''
+        Count interaction of agents with indices i and j.
+        '''
+        key = (min(i, j), max(i, j))
+        self.interactions[key] = self.interactions.get(key, 0) + 1
+
+    def interact_many(self, rows, cols, amounts):
+        '''
+        Batch version of interact, repeated pairs add up their amounts. The
+        (lazily decayed) old scores of all pairs are computed at once and the
+        dictionaries are updated in bulk.
+        '''
+        rows, cols, amounts = self.merge_pairs(rows, cols, amounts)
+        keys = list(zip(rows.tolist(), cols.tolist()))
+        stored = np.array([self.friends_score.get(key, 0) for key in keys], dtype=float)
+        last = np.array([self.last_interaction.get(key, self.tick) for key in keys], dtype=np.int64)
+        old = stored * self.decay_factor(last)
+        scores = old + amounts
+
+        self.last_interaction.update(dict.fromkeys(keys, self.tick))
+        nonzero = np.flatnonzero(scores)
+        self.friends_score.update(zip([keys[k] for k in nonzero], scores[nonzero].tolist()))
+        for k in nonzero.tolist():
+            i, j = keys[k]
+            self.partners.setdefault(i, set()).add(j)
+            self.partners.setdefault(j, set()).add(i)
+
+        self.update_stats_many(rows, cols, old, scores)
+        self.defer_expiry(rows.tolist(), cols.tolist(), scores.tolist())
+
+    def decay(self, decay):
+        '''
+        Decay friends scores of all pairs that did not interact since the
+        last decay, scores that reach zero are dropped.
+        '''
+        if self.lazy:
+            return self.lazy_decay_step(decay)
+
+        lost = []
+        for key, score in list(self.friends_score.items()):
+            if self.last_interaction[key] != self.tick:
+                score *= decay
+                if score:
+                    self.friends_score[key] = score
+                else:
+                    del self.friends_score[key]
+                    self.partners[key[0]].discard(key[1])
+                    self.partners[key[1]].discard(key[0])
+                    lost.append(key)
+        self.tick += 1
+
+        lost = np.array(lost, dtype=np.int64).reshape(-1, 2)
+        self.change_friends(lost[:, 0], lost[:, 1], -1)
+        self.decay_stats(decay)
+
+    def score(self, i, j):
+        key = (min(i, j), max(i, j))
+        if key not in self.friends_score:
+            return 0
+        return self.friends_score[key] * self.decay_factor(self.last_interaction[key])
+
+    def touched_at(self, i, j):
+        return self.last_interaction.get((min(i, j), max(i, j)))
+
+    def stored(self, i, j):
+        return (min(i, j), max(i, j)) in self.friends_score
+
+    def stored_pairs(self):
+        # pairs with a stored nonzero score, each pair once
+        pairs = np.array(list(self.friends_score), dtype=np.int64).reshape(-1, 2)
+        scores = np.fromiter(self.friends_score.values(), dtype=float, count=len(pairs))
+        last = np.array([self.last_interaction[key] for key in self.friends_score], dtype=np.int64)
+        return pairs[:, 0], pairs[:, 1], scores, last
+
+    def set_scores(self, rows, cols, scores):
+        for i, j, score in zip(rows, cols, scores):
+            self.friends_score[(i, j)] = score
+
+    def remove_pair(self, i, j):
+        key = (min(i, j), max(i, j))
+        del self.friends_score[key]
+        self.partners[key[0]].discard(key[1])
+        self.partners[key[1]].discard(key[0])
+
+    def friend_pairs(self):
+        '''
+        Returns row indices, column indices and scores of all nonzero
+        friends scores (every pair in both directions).
+        '''
+        a, b, scores, last = self.stored_pairs()
+        if self.lazy:
+            scores = scores * self.decay_factor(last)
+            nonzero = scores != 0
+            a, b, scores = a[nonzero], b[nonzero], scores[nonzero]
+        rows = np.concatenate([a, b])
+        cols = np.concatenate([b, a])
+        return rows, cols, np.concatenate([scores, scores])
+
+    def scores_of(self, i):
+        '''
+        Returns indices and friends scores of the friends of agent i.
+        '''
+        friends = np.array(sorted(self.partners.get(i, ())), dtype=np.int64)
+        scores = np.array([self.score(i, j) for j in friends]).reshape(-1)
+        nonzero = scores > 0
+        return friends[nonzero], scores[nonzero]
+
+    def nr_friends(self, i):
+        return sum(value for key, value in self.friends.items() if i in key)
+
+    def checkpoint_pairs(self):
+        # dictionaries as key and value arrays, in iteration order
+        score_pairs, scores = pair_arrays(self.friends_score, float)
+        interaction_pairs, interactions = pair_arrays(self.interactions, np.int64)
+        touched_pairs, touched_ticks = pair_arrays(self.last_interaction, np.int64)
+        return dict(
+            score_pairs=score_pairs, scores=scores,
+            interaction_pairs=interaction_pairs, interactions=interactions,
+            touched_pairs=touched_pairs, touched_ticks=touched_ticks
+        )
+
+    def restore_pairs(self, arrays):
+        def pairs(keys, values):
+            return dict(zip(map(tuple, keys.tolist()), values.tolist()))
+
+        self.friends_score = pairs(arrays['score_pairs'], arrays['scores'])
+        self.interactions = pairs(arrays['interaction_pairs'], arrays['interactions'])
+        self.last_interaction = pairs(arrays['touched_pairs'], arrays['touched_ticks'])
+        self.partners = {}
+        for i, j in self.friends_score:
+            self.partners.setdefault(i, set()).add(j)
+            self.partners.setdefault(j, set()).add(i)
+
+    def frame(self, name):
+        '''
+        Returns dense DataFrame of matrix with the agent id's used as labels,
+        built on demand.
+        '''
+        n = len(self.ids)
+        if name in ('social_distance', 'spatial_distance'):
+            mat = np.zeros((n, n))
+            for rows, social, spatial in self.distance_tiles():
+                mat[rows] = social if name == 'social_distance' else spatial
+        elif name == 'last_interaction':
+            mat = np.full((n, n), float(self.tick))
+            for (i, j), tick in self.last_interaction.items():
+                mat[i, j] = mat[j, i] = self.tick - tick
+        else:
+            if name == 'friends_score':
+                self.materialize()
+            mat = np.zeros((n, n))
+            for (i, j), value in getattr(self, name).items():
+                mat[i, j] = value
+                # interaction counts are only kept above the diagonal
+                if name != 'interactions':
+                    mat[j, i] = value
+        return pd.DataFrame(mat, index=self.ids, columns=self.ids)
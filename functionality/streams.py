@@ -0,0 +1,38 @@
+import numpy as np
+
+
+# one stream per kind of random decision in a Friends run
+STREAM_NAMES = ('layout', 'setup', 'schedule', 'trips', 'movement', 'interaction')
+
+
+class RandomStreams:
+    '''
+    Named, independent NumPy generators derived from one seed with a
+    SeedSequence: layout (Schelling warm-up), setup (speeds and travel
+    times), schedule (activation order), trips (destination choice),
+    movement (paths) and interaction. Runs with the same seed share the
+    random numbers of every stream, also when another stream is used
+    differently, which pairs scenarios run from the same seed (common
+    random numbers). Without a seed the streams are seeded from fresh
+    entropy, kept in entropy to reproduce the run.
+    '''
+
+    def __init__(self, seed=None, names=STREAM_NAMES):
+        sequence = np.random.SeedSequence(seed)
+        self.entropy = sequence.entropy
+        self.sequences = dict(zip(names, sequence.spawn(len(names))))
+        for name, child in self.sequences.items():
+            setattr(self, name, np.random.Generator(np.random.PCG64(child)))
+
+    def seed_of(self, name):
+        '''
+        Returns integer seed derived for a stream, for generators that are
+        not NumPy generators (e.g. Mesa's random.Random) or models that take
+        an integer seed.
+        '''
+        return int(self.sequences[name].generate_state(1, np.uint64)[0])
+
+
+def default_rng(rng=None):
+    # fresh generator for callers without their own stream
+    return np.random.default_rng() if rng is None else rng
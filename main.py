@@ -4,15 +4,17 @@ import time
 from os import path, makedirs
 
 from functionality.model import Friends
+from functionality.layout_cache import LayoutCache
 from visualization.graph_visualization import \
     visualize_network, \
     distance_histograms, \
     friends_speed_histogram
 from visualization.model_report import create_model_report
 from functionality.helpers import create_sim_stats
+from functionality.scenarios import SCENARIOS, run_paired, paired_differences
 
 
-def main(iter, seg, mob, hub):
+def main(iter, seg, mob, hub, seed=None):
 
     # Print model parameters to console
     parameters = [seg, mob, hub]
@@ -29,9 +31,9 @@ def main(iter, seg, mob, hub):
     # Tolerance level to 0
     if seg == False:
         s = 0
-        friends = Friends(tolerance=s, mobility=mob, hubs=hub)
+        friends = Friends(tolerance=s, mobility=mob, hubs=hub, seed=seed, layout_cache=LayoutCache())
     else:
-        friends = Friends(mobility=mob, hubs=hub)
+        friends = Friends(mobility=mob, hubs=hub, seed=seed, layout_cache=LayoutCache())
 
     all_dfs = []
     scores = np.zeros(friends.height + friends.width)
@@ -68,6 +70,30 @@ def main(iter, seg, mob, hub):
         create_model_report(html_report=True)  # set html_report to True to produce pandas_profiling report
 
 
+def main_paired(iter, seg, scenarios=SCENARIOS, baseline='no hubs'):
+    '''
+    Runs the scenarios (hubs on/off, mobility variants) with common random
+    numbers, every scenario once per seed 0 to iter - 1, and prints the mean
+    and standard error of the paired differences to the baseline.
+    '''
+    print('RUNNING Friends model for ' + str(iter) + ' PAIRED ITERATION(S) of\n' +
+        ', '.join(scenarios) + '\n')
+
+    # Tolerance level to 0, scenarios run from the same seed share their
+    # Schelling layout through the layout cache
+    params = {} if seg else dict(tolerance=0)
+    params['layout_cache'] = LayoutCache()
+
+    begin = time.time()
+    results = run_paired(scenarios, range(iter), **params)
+    end = time.time()
+    print("Model run-time:", end - begin)
+    results.to_csv('data/avg_stats/paired_' + str(iter) + '_runs.csv')
+
+    differences = paired_differences(results, baseline)
+    print(differences.groupby(level='scenario').agg(['mean', 'sem']))
+
+
 if __name__ == '__main__':
     '''Run model: iterations, segregation, varying mobility, social hubs'''
     # READ ME FIRST
@@ -92,3 +118,4 @@ if __name__ == '__main__':
         makedirs('data/html')
 
     main(iter=1, seg=False, mob=0.5, hub=False) # SIMULATION CONFIGURATION
+    # main_paired(iter=10, seg=False) # PAIRED SCENARIOS with common random numbers
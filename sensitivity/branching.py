@@ -0,0 +1,112 @@
+"""
+Branching runs: a shared burn-in is simulated once and every parameter
+variant continues from its final state. Only parameters that are read
+every step can be branched on.
+"""
+
+import os
+import tempfile
+import multiprocessing as mp
+import pandas as pd
+
+import sys
+sys.path.append('../')
+
+from functionality.model import Friends
+from functionality import kernels
+
+# parameters that take effect after the burn-in
+BRANCHABLE = ('decay', 'social_extroversion')
+
+# burn-in model of the worker processes, forked workers inherit it from the
+# parent, other workers load it from a checkpoint
+BASE = None
+
+
+def set_base(model):
+    global BASE
+    BASE = model
+
+
+def load_base(model_cls, path):
+    model = model_cls.load_checkpoint(path)
+    if model.jit:
+        kernels.warmup()
+    set_base(model)
+
+
+def run_branch(task):
+    # runs one variant on the worker's own copy of the burn-in model, every
+    # worker process runs a single branch
+    variant, steps = task
+    model = BASE
+    for name, value in variant.items():
+        setattr(model, name, value)
+
+    # a burn-in that converged does not stop the branches
+    model.running = True
+    model.converged_at = None
+    if model.convergence is not None:
+        model.convergence.converged_at = None
+
+    model.run_model(steps)
+    reporters = model.data_collector.get_model_vars_dataframe().iloc[-1]
+    return dict(variant, converged_at=model.converged_at, **reporters)
+
+
+def run_branches(variants, burn_in_steps=100, steps=400, processes=None, model=Friends, **params):
+    '''
+    Runs model with params for burn_in_steps once, then every variant (dict
+    of decay and/or social_extroversion) for steps more in its own worker
+    process. Workers are forked from the parent so they share the burn-in
+    state copy-on-write; where fork is not available the burn-in is written
+    to a checkpoint that every worker loads. All branches continue from the
+    same random states. Returns DataFrame of the variants and the reporters
+    at the end of every branch.
+    '''
+    for variant in variants:
+        invalid = sorted(set(variant) - set(BRANCHABLE))
+        if invalid:
+            raise ValueError(
+                'cannot branch on ' + ', '.join(invalid) +
+                ', only on ' + ', '.join(BRANCHABLE)
+            )
+
+    base = model(**params)
+    base.run_model(burn_in_steps)
+
+    if processes is None:
+        processes = max(mp.cpu_count() - 1, 1)
+    tasks = [(variant, steps) for variant in variants]
+
+    if 'fork' in mp.get_all_start_methods():
+        # kernels compiled in the parent are inherited by the workers
+        if base.jit:
+            kernels.warmup()
+        set_base(base)
+        try:
+            with mp.get_context('fork').Pool(processes, maxtasksperchild=1) as pool:
+                results = pool.map(run_branch, tasks, chunksize=1)
+        finally:
+            set_base(None)
+    else:
+        fd, path = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        try:
+            base.save_checkpoint(path)
+            with mp.Pool(processes, load_base, (model, path), maxtasksperchild=1) as pool:
+                results = pool.map(run_branch, tasks, chunksize=1)
+        finally:
+            os.remove(path)
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    variants = [
+        dict(decay=decay, social_extroversion=extroversion)
+        for decay in (0.9, 0.95, 0.99)
+        for extroversion in (0.2, 0.4, 0.6, 0.8)
+    ]
+    results = run_branches(variants, burn_in_steps=100, steps=400, seed=0)
+    print(results)
+    results.to_csv('data/branching.csv')
@@ -1,3 +1,6 @@
+import os
+import tempfile
+import itertools
 import numpy as np
 import pandas as pd
 import multiprocessing as mp
@@ -7,15 +10,36 @@ import sys
 sys.path.append('../')
 
 from functionality.model import Friends
+from functionality import kernels
+from functionality.layout_cache import LayoutCache
 
+# samples and outputs, in the columns of the results file
+COLUMNS = [
+    'tolerance', 'social_extroversion', 'mobility', 'decay',
+    'friends_score', 'social_distance', 'spatial_distance'
+]
 
-def run_model(vals):
+# rows per block when writing the results file
+BLOCK_SIZE = 10000
+
+# run the model with the compiled kernels, set per worker by init_worker
+JIT = False
+
+# Schelling layouts shared on disk by all workers, seeded runs with the same
+# tolerance reuse the layout
+LAYOUT_CACHE = LayoutCache()
+
+
+def run_model(vals, seed=None):
     md = Friends(
         population_size=10,
         tolerance=vals[0],
         social_extroversion=vals[1],
         mobility=vals[2],
-        decay=vals[3]
+        decay=vals[3],
+        jit=JIT,
+        seed=seed,
+        layout_cache=LAYOUT_CACHE
     )
     max_steps = 20
     md.run_model(step_count=max_steps)
@@ -29,36 +53,82 @@ def create_samples(problem):
     replicates = 10
     distinct_samples = 2
 
-    # We get all our samples here
+    # We get all our samples here, every replicate runs with its own seed so
+    # samples of the same replicate and tolerance share their layout
     param_values = saltelli.sample(problem, distinct_samples)
+    seeds = np.repeat(np.arange(replicates), len(param_values))
     param_values = np.array(list(param_values) * replicates)
-    return param_values
-
-
-def run_analysis(samples):
-    data = []
-    p = mp.Pool(processes=mp.cpu_count() - 1)
-    for item in samples:
-        p.apply_async(run_model, args=[item], callback=make_log_result(data, len(samples)))
-    p.close()
-    p.join()
-
-    df = pd.DataFrame(
-        data,
-        columns=[
-            'tolerance', 'social_extroversion', 'mobility', 'decay',
-            'friends_score', 'social_distance', 'spatial_distance'
-        ]
-    )
-    return df
+    return param_values, seeds
+
+
+def run_sample(task):
+    # runs the model for one sample, tagged with its sample index
+    index, (vals, seed) = task
+    return index, run_model(vals, None if seed is None else int(seed))
+
+
+def init_worker(jit):
+    # compiles (or loads from the on-disk cache) the kernels once per worker
+    # process, before its first chunk of samples
+    global JIT
+    JIT = jit
+    if jit:
+        kernels.warmup()
+
+
+def run_analysis(samples, seeds=None, file_name='data/global.csv', chunksize=None, processes=None, jit=False):
+    '''
+    Runs the model for every sample (with the seed of the sample if seeds
+    are given) in a worker pool and writes the samples and outputs to a csv
+    file in sample order (the order SALib's analysis expects). Samples are sent to the workers in chunks and results are
+    written to a binary file at the position of their sample index as they
+    arrive, so neither samples nor results have to be kept in memory. The
+    csv file is written from the binary file at the end. With jit the
+    workers run the model with the compiled kernels.
+    '''
+    if processes is None:
+        processes = max(mp.cpu_count() - 1, 1)
+    total = len(samples) if hasattr(samples, '__len__') else None
+    if chunksize is None:
+        chunksize = max(total // (4 * processes), 1) if total else 16
+    record = len(COLUMNS) * np.dtype(float).itemsize
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_name)), suffix='.bin')
+    try:
+        count = 0
+        with os.fdopen(fd, 'wb') as f, mp.Pool(processes, init_worker, (jit,)) as pool:
+            if seeds is None:
+                seeds = itertools.repeat(None)
+            tasks = enumerate(zip(samples, seeds))
+            for index, values in pool.imap_unordered(run_sample, tasks, chunksize):
+                f.seek(index * record)
+                f.write(np.asarray(values, dtype=float).tobytes())
+                count += 1
+                log_progress(count, total)
+
+        # csv in sample order, converted in blocks
+        pd.DataFrame(columns=COLUMNS).to_csv(file_name)
+        if count:
+            results = np.memmap(tmp, dtype=float, mode='r', shape=(count, len(COLUMNS)))
+            for start in range(0, count, BLOCK_SIZE):
+                block = results[start:start + BLOCK_SIZE]
+                index = range(start, start + len(block))
+                pd.DataFrame(block, columns=COLUMNS, index=index).to_csv(file_name, mode='a', header=False)
+            del results
+    finally:
+        os.remove(tmp)
+    return file_name
 
 
-def make_log_result(results, len_data):
-    def log_result(retval):
-        results.append(retval)
-        if len(results) % (len_data // 20) == 0:
-            print('{:.0%} done'.format(len(results)/len_data))
-    return log_result
+def log_progress(count, total):
+    # prints progress every 5% of the samples, or every 1000 samples if
+    # the number of samples is unknown
+    step = max(total // 20, 1) if total else 1000
+    if count % step == 0:
+        if total:
+            print('{:.0%} done'.format(count / total))
+        else:
+            print('{} done'.format(count))
 
 
 if __name__ == '__main__':
@@ -67,6 +137,5 @@ if __name__ == '__main__':
         'names': ['tolerance', 'social_extroversion', 'mobility', 'decay'],
         'bounds': [[0.0, 1.0], [0.0, 1.0], [0.0, 1.0], [0.0, 1.0]]
     }
-    samples = create_samples(problem)
-    results = run_analysis(samples)
-    results.to_csv('data/global.csv')
+    samples, seeds = create_samples(problem)
+    run_analysis(samples, seeds, 'data/global.csv')
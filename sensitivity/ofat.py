@@ -8,6 +8,7 @@ sys.path.append('../')
 import time
 
 from functionality.model import Friends
+from functionality.layout_cache import LayoutCache
 from mesa.batchrunner import BatchRunnerMP, BatchRunner
 from functionality.agent import Human
 from SALib.analyze import sobol
@@ -29,10 +30,18 @@ replicates = 100
 max_steps = 1000
 distinct_samples = 15
 
+# Stop runs at steady state instead of max_steps, e.g. dict(window=50, rtol=0.01)
+convergence = None
+
+# Replicates run with seeds 0 to replicates - 1, runs with the same seed
+# and tolerance share their Schelling layout through the layout cache
+layout_cache = LayoutCache()
+
 # Set the outputs
 model_reporters = {"Friends score": lambda m: m.avg_friends_score(),
                    "Friends distance": lambda m: m.avg_friends_social_distance(),
-                   "Friends spatial distance": lambda m: m.avg_friends_spatial_distance()}
+                   "Friends spatial distance": lambda m: m.avg_friends_spatial_distance(),
+                   "Converged at": lambda m: m.converged_at}
 
 data = {}
 
@@ -42,8 +51,9 @@ for i, var in enumerate(problem['names']):
 
     batch = BatchRunner(Friends,
                         max_steps=max_steps,
-                        iterations=replicates,
-                        variable_parameters={var: samples},
+                        iterations=1,
+                        variable_parameters={var: samples, 'seed': range(replicates)},
+                        fixed_parameters={'convergence': convergence, 'layout_cache': layout_cache},
                         model_reporters=model_reporters,
                         display_progress=True)
 
@@ -14,6 +14,7 @@ import sys
 sys.path.append('../')
 
 from functionality.model import Friends
+from functionality.layout_cache import LayoutCache
 
 problem = {
     'num_vars': 1,
@@ -26,10 +27,18 @@ replicates = 10
 max_steps = 10
 distinct_samples = 10
 
+# Stop runs at steady state instead of max_steps, e.g. dict(window=50, rtol=0.01)
+convergence = None
+
+# Replicates run with seeds 0 to replicates - 1, runs with the same seed
+# and tolerance share their Schelling layout through the layout cache
+layout_cache = LayoutCache()
+
 # Set the outputs
 model_reporters = {"Friends score": lambda m: m.avg_friends_score(),
                    "Friends distance": lambda m: m.avg_friends_social_distance(),
-                   "Friends spatial distance": lambda m: m.avg_friends_spatial_distance()}
+                   "Friends spatial distance": lambda m: m.avg_friends_spatial_distance(),
+                   "Converged at": lambda m: m.converged_at}
 
 data = {}
 
@@ -44,8 +53,9 @@ for i, var in enumerate(problem['names']):
 
     batch = BatchRunnerMP(Friends,
                         max_steps=max_steps,
-                        iterations=replicates,
-                        variable_parameters={var: samples},
+                        iterations=1,
+                        variable_parameters={var: samples, 'seed': range(replicates)},
+                        fixed_parameters={'convergence': convergence, 'layout_cache': layout_cache},
                         model_reporters=model_reporters,
                         display_progress=True,
                         nr_processes=multiprocessing.cpu_count() - 1)
@@ -68,10 +78,18 @@ def perform_analysis():
     max_steps = 10
     distinct_samples = 10
 
+    # Stop runs at steady state instead of max_steps, e.g. dict(window=50, rtol=0.01)
+    convergence = None
+
+    # Replicates run with seeds 0 to replicates - 1, runs with the same seed
+    # and tolerance share their Schelling layout through the layout cache
+    layout_cache = LayoutCache()
+
     # Set the outputs
     model_reporters = {"Friends score": lambda m: m.avg_friends_score(),
                        "Friends distance": lambda m: m.avg_friends_social_distance(),
-                       "Friends spatial distance": lambda m: m.avg_friends_spatial_distance()}
+                       "Friends spatial distance": lambda m: m.avg_friends_spatial_distance(),
+                       "Converged at": lambda m: m.converged_at}
 
     data = {}
     begin = time.time()
@@ -82,8 +100,9 @@ def perform_analysis():
 
         batch = BatchRunnerMP(Friends,
                             max_steps=max_steps,
-                            iterations=replicates,
-                            variable_parameters={var: samples},
+                            iterations=1,
+                            variable_parameters={var: samples, 'seed': range(replicates)},
+                            fixed_parameters={'convergence': convergence, 'layout_cache': layout_cache},
                             model_reporters=model_reporters,
                             display_progress=True,
                             nr_processes=multiprocessing.cpu_count() - 1)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from functionality.model import Friends
+from functionality.array_model import ArrayFriends
+
+
+@pytest.mark.parametrize('model_cls', [Friends, ArrayFriends])
+@pytest.mark.parametrize('params', [
+    dict(),
+    dict(sparse=True),
+    dict(lazy_decay=True),
+    dict(sparse=True, lazy_decay=True, hubs=False),
+])
+def test_loaded_checkpoint_continues_like_the_saved_run(tmp_path, model_cls, params):
+    # save -> load -> continue compared to an uninterrupted run
+    path = str(tmp_path / 'checkpoint.npz')
+    model = model_cls(population_size=60, height=12, width=12, seed=11, **params)
+    model.run_model(20)
+    model.save_checkpoint(path)
+    loaded = model_cls.load_checkpoint(path)
+
+    model.run_model(30)
+    loaded.run_model(30)
+
+    expected = model.data_collector.get_model_vars_dataframe()
+    result = loaded.data_collector.get_model_vars_dataframe()
+    assert len(result) == 51
+    assert result.equals(expected)
+    assert np.array_equal(loaded.positions(), model.positions())
+    assert np.array_equal(loaded.hub_values, model.hub_values)
+
+
+def test_checkpoint_of_another_model_is_rejected(tmp_path):
+    path = str(tmp_path / 'checkpoint.npz')
+    Friends(population_size=20, height=8, width=8, seed=0).save_checkpoint(path)
+    with pytest.raises(ValueError):
+        ArrayFriends.load_checkpoint(path)
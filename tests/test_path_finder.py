@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from functionality.path_finder import find_path
+
+
+def walk(path):
+    positions = np.cumsum([[0, 0]] + path, axis=0)
+    return [tuple(pos) for pos in positions]
+
+
+@pytest.mark.parametrize('end, length', [
+    ([0, 0], 40),   # returns to the occupied start
+    ([0, 0], 4),
+    ([1, 0], 25),   # 26 cells do not fit in the 5 x 5 bounds
+    ([2, 2], 26),
+])
+def test_infeasible_paths(end, length):
+    assert find_path([0, 0], end, length, [[-2, -2], [2, 2]]) is False
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_path_filling_the_bounds(seed):
+    bounds = [[-2, -2], [2, 2]]
+    path = find_path([0, 0], [2, 2], 24, bounds, np.random.default_rng(seed))
+    positions = walk(path)
+    assert len(path) == 24 and positions[-1] == (2, 2)
+    assert len(set(positions)) == 25
+    assert all(-2 <= x <= 2 and -2 <= y <= 2 for x, y in positions)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from functionality.schelling import SchellingModel, ArraySchellingModel
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('height, width, population', [
+    (20, 20, 200),
+    (12, 7, 60),    # non-square grid
+    (6, 6, 34),     # nearly full grid
+])
+def test_array_model_runs_like_agent_model(seed, height, width, population):
+    # seeded runs agree on characters, and on positions and happy counts
+    # after every step
+    model = SchellingModel(height, width, 0.3, population, seed=seed)
+    array_model = ArraySchellingModel(height, width, 0.3, population, seed=seed)
+    agents = model.schedule.agents
+    assert np.array_equal(array_model.characters, [agent.character for agent in agents])
+
+    for step in range(20):
+        model.step()
+        array_model.step()
+        assert np.array_equal(array_model.positions, [agent.pos for agent in agents]), step
+        assert array_model.happy == model.happy, step
+        assert array_model.running == model.running, step
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from functionality.model import Friends
+from functionality.array_model import ArrayFriends
+
+
+@pytest.mark.parametrize('hubs', [True, False])
+@pytest.mark.parametrize('params', [
+    dict(),
+    dict(batch_paths=True),
+])
+def test_agents_without_destinations_stay_home(hubs, params):
+    # speed 2 agents on a 2 x 2 grid have no reachable destination
+    model = Friends(height=2, width=2, population_size=2, mobility=1, hubs=hubs, seed=0, **params)
+    assert not any(agent.reachable.any() for agent in model.schedule.agents)
+    model.run_model(5)
+    assert all(agent.is_home() for agent in model.schedule.agents)
+
+
+@pytest.mark.parametrize('hubs', [True, False])
+def test_unreachable_destinations_are_not_chosen(hubs):
+    model = Friends(height=5, width=5, population_size=4, hubs=hubs, seed=0)
+    for agent in model.schedule.agents:
+        agent.reachable[:] = False
+        assert agent.choose_destination() is None
+    model.run_model(5)
+    assert all(agent.is_home() for agent in model.schedule.agents)
+
+
+@pytest.mark.parametrize('hubs', [True, False])
+def test_array_agents_without_destinations_stay_home(hubs):
+    model = ArrayFriends(height=2, width=2, population_size=2, mobility=1, hubs=hubs, seed=0)
+    model.run_model(5)
+    assert np.array_equal(model.pos, model.home)
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from functionality.state import DenseState, SparseState
+
+
+@pytest.mark.parametrize('lazy_decay', [None, 0.5])
+def test_sparse_interact_many_matches_dense(lazy_decay):
+    rng = np.random.default_rng(0)
+    n = 30
+    ids = np.arange(1, n + 1)
+    characters = rng.random(n)
+    homes = rng.integers(0, 10, size=(n, 2))
+    states = [state(ids, characters, homes, lazy_decay) for state in (DenseState, SparseState)]
+    for tick in range(40):
+        rows = rng.integers(0, n, size=20)
+        cols = (rows + rng.integers(1, n, size=20)) % n
+        amounts = rng.random(20) * (rng.random(20) < 0.7)
+        for state in states:
+            state.interact_many(rows, cols, amounts)
+            state.count_many(rows, cols)
+            state.decay(0.5)
+
+    dense, sparse = states
+    for name in ('friend_count', 'score_sum', 'social_sum', 'spatial_sum'):
+        np.testing.assert_allclose(getattr(sparse, name), getattr(dense, name))
+    np.testing.assert_allclose(sparse.frame('friends_score').values, dense.frame('friends_score').values)
+    np.testing.assert_allclose(sparse.frame('interactions').values, dense.frame('interactions').values)
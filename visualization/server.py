@@ -66,6 +66,23 @@ def draw_agent(agent):
 
     return portrayal
 
+class HubCanvasGrid(CanvasGrid):
+    '''
+    CanvasGrid that also draws a cell view for every grid cell, cell values
+    are kept in the model instead of as agents on the grid.
+    '''
+    def render(self, model):
+        grid_state = super().render(model)
+        for x in range(model.grid.width):
+            for y in range(model.grid.height):
+                portrayal = self.portrayal_method(model.get_cell((x, y)))
+                if portrayal:
+                    portrayal["x"] = x
+                    portrayal["y"] = y
+                    grid_state[portrayal["Layer"]].append(portrayal)
+        return grid_state
+
+
 # Generating animated charts
 friend_chart = ChartModule(
     [{"Label": "Friends score", "Color": "Black"}],
@@ -83,7 +100,7 @@ spatial_chart = ChartModule(
 )
 
 # Drawing the grid, initialising elements and launching server
-canvas_element = CanvasGrid(draw_agent, 20, 20, 500, 500)
+canvas_element = HubCanvasGrid(draw_agent, 20, 20, 500, 500)
 
 element_list = [canvas_element, friend_chart, social_chart, spatial_chart]
 